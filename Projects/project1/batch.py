@@ -0,0 +1,178 @@
+"""Simulate many games of Hog at once using NumPy arrays.
+
+Strategies are given as roll tables: GOAL x GOAL arrays in which
+table[score][opponent_score] is the number of dice to roll.  Any strategy
+function can be turned into one with roll_table.
+
+Each step of the simulation advances every unfinished game by one turn.  By
+default, turn scores are drawn directly from the exact turn distributions in
+solver.py, which needs one random number per turn instead of one per die.
+When DICE_OUTCOMES is given, every game instead rolls dice that cycle through
+those outcomes, exactly like play does with make_test_dice.  The rules of
+every turn are read from the tables of a ruleset from hog.make_rules.
+"""
+
+import numpy as np
+
+from hog import standard_rules
+from solver import max_rolls, max_turn_score, turn_distribution
+
+def roll_table(strategy, rules=standard_rules):
+    """Return the GOAL x GOAL roll table of STRATEGY under RULES, which may be
+    a strategy function, a strategy from hog.compile_strategy, or a nested
+    sequence of roll counts.
+
+    >>> from hog import always_roll
+    >>> table = roll_table(always_roll(3))
+    >>> table.shape, int(table[12, 40])
+    ((100, 100), 3)
+    """
+    goal = rules['goal']
+    if hasattr(strategy, 'table') and len(strategy.table) == goal:
+        strategy = strategy.table
+    elif callable(strategy):
+        strategy = [[strategy(score, opponent_score)
+                     for opponent_score in range(goal)] for score in range(goal)]
+    table = np.array(strategy, dtype=np.int64)
+    assert table.shape == (goal, goal), 'Roll tables must be GOAL x GOAL'
+    assert (table >= 0).all(), 'Cannot roll a negative number of dice.'
+    return table
+
+guide_size = 4096  # Buckets per turn distribution in the guide table
+
+def _turn_cdfs(sides_choices):
+    """Return three arrays for dice with each number of SIDES_CHOICES: the
+    cumulative turn distributions of every (dice, num_rolls) group as one
+    flat array, the index of the next larger value after each entry of that
+    array, and a guide table that gives the first score worth checking for
+    a random number in each of guide_size buckets.
+    """
+    groups = []
+    for sides in sides_choices:
+        groups.append(np.ones(max_turn_score + 1))  # Rolling 0 scores 0 here
+        for num_rolls in range(1, max_rolls + 1):
+            cdf = np.cumsum(turn_distribution(num_rolls, sides))
+            cdf[-1] = 1.0
+            groups.append(cdf)
+    cdfs = np.array(groups)
+    buckets = np.arange(guide_size) / guide_size
+    guide = [np.searchsorted(cdf, buckets, side='right') for cdf in cdfs]
+    offsets = np.arange(len(groups))[:, None] * (max_turn_score + 1)
+    cdfs, guide = cdfs.ravel(), (np.array(guide) + offsets).ravel()
+    step = np.arange(len(cdfs))
+    for index in range(len(cdfs) - 2, -1, -1):
+        if cdfs[index + 1] == cdfs[index]:
+            step[index] = step[index + 1]
+    return cdfs, np.minimum(step + 1, len(cdfs) - 1), guide
+
+_cdfs = {}
+
+def _sample_turns(rng, group, sides_choices):
+    """Draw one turn score for each game in GROUP, the index of its kind of
+    dice in SIDES_CHOICES times (max_rolls + 1) plus the number of dice
+    rolled.
+
+    The guide table lands on or just before the sampled score, which is then
+    found by stepping forward past the cumulative probabilities below it.
+    """
+    if sides_choices not in _cdfs:
+        _cdfs[sides_choices] = _turn_cdfs(sides_choices)
+    cdfs, step, guide = _cdfs[sides_choices]
+    u = rng.random(len(group))
+    index = guide[group * guide_size + (u * guide_size).astype(np.int64)]
+    behind = np.flatnonzero(cdfs[index] <= u)
+    while len(behind):
+        index[behind] = step[index[behind]]
+        behind = behind[cdfs[index[behind]] <= u[behind]]
+    return index - group * (max_turn_score + 1)
+
+def _roll_outcomes(outcomes, position, num_rolls):
+    """Return the turn scores of games that roll NUM_ROLLS dice from the
+    cycling OUTCOMES, starting at index POSITION of each game.
+    """
+    k = np.arange(max_rolls)
+    rolled = k[None, :] < num_rolls[:, None]
+    faces = outcomes[(position[:, None] + k[None, :]) % len(outcomes)]
+    faces = np.where(rolled, faces, 0)
+    pig_out = ((faces == 1) & rolled).any(axis=1)
+    return np.where(pig_out, 1, faces.sum(axis=1))
+
+def play_games(strategy0, strategy1, num_games, seed=None, dice_outcomes=None,
+               rules=standard_rules):
+    """Simulate NUM_GAMES games and return an array of the winners, 0 if the
+    first player won and 1 otherwise.
+
+    strategy0:      Roll table or strategy function of player 0.
+    strategy1:      Roll table or strategy function of player 1.
+    seed:           Seed for the random turn scores.
+    dice_outcomes:  If given, a sequence that all dice cycle through instead.
+    rules:          The ruleset, from hog.make_rules.
+
+    >>> from hog import always_roll
+    >>> play_games(always_roll(2), always_roll(1), 3, dice_outcomes=[6])
+    array([0, 0, 0])
+    >>> play_games(always_roll(1), always_roll(1), 3, dice_outcomes=[3, 6])
+    array([1, 1, 1])
+    """
+    goal, sides_choices = rules['goal'], rules['dice_sides']
+    tables = [_turn_tables(roll_table(s, rules), rules)
+              for s in (strategy0, strategy1)]
+    rng = np.random.default_rng(seed)
+    if dice_outcomes is not None:
+        outcomes = np.array(dice_outcomes, dtype=np.int64)
+        position = np.zeros(num_games, dtype=np.int64)
+    winners = np.zeros(num_games, dtype=np.int64)
+    games = np.arange(num_games)
+    score = np.zeros(num_games, dtype=np.int32)
+    opponent_score = np.zeros(num_games, dtype=np.int32)
+    who = 0
+    # All unfinished games have taken the same number of turns, so the same
+    # player is about to roll in every one of them.
+    while len(games):
+        num_rolls, group, bacon = tables[who]
+        state = score * goal + opponent_score
+        if dice_outcomes is None:
+            turn = _sample_turns(rng, group[state], sides_choices)
+            turn += bacon[state]
+        else:
+            rolls = num_rolls[state]
+            turn = _roll_outcomes(outcomes, position, rolls)
+            turn = np.where(rolls == 0, bacon[state], turn)
+            position += rolls
+        score = score + turn
+        won = score >= goal
+        if won.any():
+            winners[games[won]] = who
+            playing = ~won
+            games, score = games[playing], score[playing]
+            opponent_score = opponent_score[playing]
+            if dice_outcomes is not None:
+                position = position[playing]
+        score, opponent_score = opponent_score, score
+        who = 1 - who
+    return winners
+
+def _turn_tables(table, rules):
+    """Return three flat arrays indexed by score * GOAL + opponent_score: the
+    number of dice actually rolled under roll TABLE and RULES, the group of
+    its turn distribution for _sample_turns, and the free bacon score if no
+    dice are rolled (otherwise 0).
+    """
+    assert rules['max_dice'] <= max_rolls, 'Rules allow too many dice'
+    num_rolls = np.minimum(table, np.array(rules['allowed']))
+    group = np.array(rules['dice']) * (max_rolls + 1) + num_rolls
+    bacon = np.where(num_rolls == 0, np.array(rules['bacon']), 0)
+    return [a.ravel().astype(np.int32) for a in (num_rolls, group, bacon)]
+
+def compare_tables(strategy, baseline, num_games=10000, seed=None,
+                   rules=standard_rules):
+    """Return the average win rate (out of 1) of STRATEGY against BASELINE,
+    playing NUM_GAMES games in each seat like compare_strategies.
+    """
+    rng = np.random.default_rng(seed)
+    seeds = rng.integers(2**63, size=2)
+    as_first = 1 - play_games(strategy, baseline, num_games, seeds[0],
+                              rules=rules).mean()
+    as_second = play_games(baseline, strategy, num_games, seeds[1],
+                           rules=rules).mean()
+    return (as_first + as_second) / 2
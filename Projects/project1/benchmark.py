@@ -0,0 +1,148 @@
+"""Performance benchmarks for the Hog simulator.
+
+Run python3 benchmark.py to time roll_dice, play, compare_strategies and
+eval_strategy_range with fixed seeds.  Results are written as JSON, and
+compared against a stored baseline file if one exists, so that a change to
+the simulator that makes it slower shows up as a regression.
+
+    python3 benchmark.py                   # Compare with the baseline
+    python3 benchmark.py --save_baseline   # Store these results as baseline
+"""
+
+import io
+import json
+import os
+import random
+from contextlib import redirect_stdout
+from time import perf_counter
+
+from dice import four_sided_dice, six_sided_dice
+from hog import (always_roll, compare_strategies, eval_strategy_range,
+                 final_strategy, play, roll_dice)
+from ucb import main
+
+seed = 61
+baseline_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'benchmark_baseline.json')
+threshold = 0.1  # Changes smaller than 10% are reported as noise
+
+# Each benchmark reports a rate, for which higher is better, or a time, for
+# which lower is better.
+play_pairs = {
+    'always_roll(5) vs always_roll(5)': (always_roll(5), always_roll(5)),
+    'always_roll(1) vs always_roll(10)': (always_roll(1), always_roll(10)),
+    'final_strategy vs always_roll(5)': (final_strategy, always_roll(5)),
+}
+
+def seed_dice():
+    """Reset the random module and the default dice to fixed seeds."""
+    random.seed(seed)
+    four_sided_dice.seed(seed)
+    six_sided_dice.seed(seed + 1)
+
+def bench_roll_dice(num_calls=200000, num_rolls=5):
+    """Return the number of roll_dice calls per second."""
+    seed_dice()
+    start = perf_counter()
+    for _ in range(num_calls):
+        roll_dice(num_rolls)
+    return num_calls / (perf_counter() - start)
+
+def bench_play(strategy0, strategy1, num_games=5000):
+    """Return the number of games per second between two strategies."""
+    seed_dice()
+    start = perf_counter()
+    for _ in range(num_games):
+        play(strategy0, strategy1)
+    return num_games / (perf_counter() - start)
+
+def bench_compare_strategies():
+    """Return the seconds taken by one call to compare_strategies."""
+    start = perf_counter()
+    compare_strategies(final_strategy, seed=seed)
+    return perf_counter() - start
+
+def bench_eval_strategy_range(lower_bound=4, upper_bound=6):
+    """Return the seconds taken by eval_strategy_range over always_roll."""
+    start = perf_counter()
+    with redirect_stdout(io.StringIO()):
+        eval_strategy_range(always_roll, lower_bound, upper_bound, seed=seed)
+    return perf_counter() - start
+
+def run_benchmarks():
+    """Return a dictionary from benchmark names to (kind, value) pairs."""
+    results = {'roll_dice calls per second': ('rate', bench_roll_dice())}
+    for label, (strategy0, strategy1) in play_pairs.items():
+        rate = bench_play(strategy0, strategy1)
+        results['play games per second: ' + label] = ('rate', rate)
+    results['compare_strategies seconds'] = ('time', bench_compare_strategies())
+    results['eval_strategy_range seconds'] = ('time', bench_eval_strategy_range())
+    return results
+
+def compare_results(results, baseline):
+    """Return a list of (name, kind, value, baseline value, verdict) for every
+    benchmark in RESULTS, where the verdict is 'faster', 'slower', 'same' or
+    'new'.
+
+    >>> compare_results({'a': ('rate', 120), 'b': ('time', 2.0)},
+    ...                 {'a': ('rate', 100), 'b': ('time', 1.0)})
+    [('a', 'rate', 120, 100, 'faster'), ('b', 'time', 2.0, 1.0, 'slower')]
+    """
+    rows = []
+    for name, (kind, value) in sorted(results.items()):
+        if name not in baseline:
+            rows.append((name, kind, value, None, 'new'))
+            continue
+        old = baseline[name][1]
+        speedup = value / old if kind == 'rate' else old / value
+        if speedup > 1 + threshold:
+            verdict = 'faster'
+        elif speedup < 1 - threshold:
+            verdict = 'slower'
+        else:
+            verdict = 'same'
+        rows.append((name, kind, value, old, verdict))
+    return rows
+
+def print_comparison(rows):
+    """Print the rows returned by compare_results."""
+    for name, kind, value, old, verdict in rows:
+        if old is None:
+            print('{0:>56}: {1:12.4g}'.format(name, value))
+        else:
+            print('{0:>56}: {1:12.4g} (baseline {2:.4g}, {3})'.format(
+                name, value, old, verdict))
+
+def load_json(path):
+    """Return the benchmark results stored at PATH, or None."""
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf8') as f:
+        return {name: tuple(pair) for name, pair in json.load(f).items()}
+
+def save_json(path, results):
+    """Store benchmark RESULTS at PATH."""
+    with open(path, 'w', encoding='utf8') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+@main
+def run(*args):
+    """Run the benchmarks and compare them with the baseline.
+
+    This function uses Python syntax/techniques not yet covered in this course.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark Hog")
+    parser.add_argument('--output', '-o', default='benchmark_results.json')
+    parser.add_argument('--baseline', '-b', default=baseline_path)
+    parser.add_argument('--save_baseline', '-s', action='store_true')
+    args = parser.parse_args()
+    results = run_benchmarks()
+    save_json(args.output, results)
+    baseline = load_json(args.baseline)
+    print_comparison(compare_results(results, baseline or {}))
+    if args.save_baseline:
+        save_json(args.baseline, results)
+    if baseline is not None and any(row[-1] == 'slower' for row in
+                                    compare_results(results, baseline)):
+        raise SystemExit(1)
@@ -0,0 +1,58 @@
+"""On-disk caches of experiment results.
+
+A cache file holds one JSON dictionary from string keys to results.  Keys are
+built from hashes of what determines a result, such as the roll table of
+each strategy, so that a cached result is reused exactly when it would come
+out the same.
+"""
+
+import os
+from hashlib import sha1
+from json import dump, load
+
+cache_dir = os.path.dirname(os.path.abspath(__file__))
+
+def cache_path(name):
+    """Return the path of the cache file called NAME next to this module."""
+    return os.path.join(cache_dir, name + '_cache.json')
+
+def table_hash(table):
+    """Return a short hash of a roll TABLE, a nested sequence of numbers.
+
+    >>> table_hash([[1, 2], [3, 4]]) == table_hash(([1, 2], (3, 4)))
+    True
+    >>> table_hash([[1, 2], [3, 4]]) == table_hash([[1, 2], [4, 3]])
+    False
+    """
+    rows = ';'.join(','.join(str(int(n)) for n in row) for row in table)
+    return sha1(rows.encode()).hexdigest()[:16]
+
+def file_hash(path):
+    """Return a short hash of the contents of the file at PATH, such as the
+    source of the module that computes a result.
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'solver.py')
+    >>> with open(path, 'w') as f:
+    ...     n = f.write('max_rolls = 10')
+    >>> file_hash(path)
+    '791736c8a75958ff'
+    """
+    with open(path, 'rb') as f:
+        return sha1(f.read()).hexdigest()[:16]
+
+def load_results(path):
+    """Return the dictionary of results stored at PATH, or an empty one."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf8') as f:
+        return load(f)
+
+def save_results(path, results):
+    """Store the dictionary RESULTS at PATH, replacing the file at once so
+    that an interrupted run never leaves a partial file behind.
+    """
+    partial = path + '.partial'
+    with open(partial, 'w', encoding='utf8') as f:
+        dump(results, f, sort_keys=True)
+    os.replace(partial, path)
@@ -14,17 +14,93 @@ Types of dice:
     cycle among a fixed set of values when rolled.
 """
 
-from random import randint
+from random import randint, Random
 
 def make_fair_dice(sides):
-    """Return a die that returns 1 to SIDES with equal chance."""
+    """Return a die that returns 1 to SIDES with equal chance.
+
+    The number of sides is also available as the sides attribute of the die.
+    """
     assert type(sides) == int and sides >= 1, 'Illegal value for sides'
     def dice():
         return randint(1,sides)
+    dice.sides = sides
+    return dice
+
+def make_buffered_dice(sides, seed=None, block_size=1000):
+    """Return a die that returns 1 to SIDES with equal chance.
+
+    The die owns a random number generator seeded with SEED, and rolls
+    outcomes from blocks of BLOCK_SIZE outcomes that it generates at once.
+    Like a fair die, it has a sides attribute.  It also has these functions
+    as attributes:
+
+      dice.seed(seed, mirror=False)
+                            -- Start over from a new SEED.  A MIRROR die
+                               rolls SIDES + 1 - k instead of each outcome k.
+      dice.clone()          -- Return a new die that rolls the same outcomes.
+      dice.split(n)         -- Return N new dice with independent outcomes.
+      dice.getstate()       -- Return an object that captures the state.
+      dice.setstate(state)  -- Restore a state returned by getstate.
+
+    This function uses Python syntax/techniques not yet covered in this course.
+
+    >>> dice = make_buffered_dice(6, seed=61)
+    >>> copy = dice.clone()
+    >>> rolls = [dice() for _ in range(2500)]
+    >>> rolls == [copy() for _ in range(2500)]
+    True
+    >>> sorted(set(rolls))
+    [1, 2, 3, 4, 5, 6]
+    >>> dice.seed(61)
+    >>> rolls == [dice() for _ in range(2500)]
+    True
+    >>> dice.seed(61, mirror=True)
+    >>> [7 - k for k in rolls[:10]] == [dice() for _ in range(10)]
+    True
+    >>> first, second = dice.split(2)
+    >>> [first() for _ in range(20)] == [second() for _ in range(20)]
+    False
+    """
+    assert type(sides) == int and sides >= 1, 'Illegal value for sides'
+    assert block_size >= 1, 'Blocks must hold at least one outcome'
+    generator = Random(seed)
+    faces = range(1, sides + 1)
+    block = []  # Upcoming outcomes, in reverse order
+    mirrored = False
+    def dice():
+        if not block:
+            outcomes = generator.choices(faces, k=block_size)
+            if mirrored:
+                outcomes = [sides + 1 - k for k in outcomes]
+            block.extend(outcomes)
+        return block.pop()
+    def reseed(seed, mirror=False):
+        nonlocal mirrored
+        generator.seed(seed)
+        block.clear()
+        mirrored = mirror
+    def clone():
+        copy = make_buffered_dice(sides, block_size=block_size)
+        copy.setstate(getstate())
+        return copy
+    def split(n):
+        return [make_buffered_dice(sides, generator.getrandbits(64), block_size)
+                for _ in range(n)]
+    def getstate():
+        return generator.getstate(), tuple(block), mirrored
+    def setstate(state):
+        nonlocal mirrored
+        generator.setstate(state[0])
+        block[:] = state[1]
+        mirrored = state[2]
+    dice.sides = sides
+    dice.seed, dice.clone, dice.split = reseed, clone, split
+    dice.getstate, dice.setstate = getstate, setstate
     return dice
 
-four_sided_dice = make_fair_dice(4)
-six_sided_dice = make_fair_dice(6)
+four_sided_dice = make_buffered_dice(4)
+six_sided_dice = make_buffered_dice(6)
 
 def make_test_dice(*outcomes):
     """Return a die that cycles deterministically through OUTCOMES.
@@ -1,12 +1,19 @@
 """The Game of Hog"""
 
 from dice import four_sided_dice, six_sided_dice, make_test_dice
+from dice import make_buffered_dice
+from cache import cache_path, load_results, save_results, table_hash
 from ucb import main, trace, log_current_line, interact
 from doctest import run_docstring_examples, testmod
+from multiprocessing import get_all_start_methods, get_context
+from math import inf, sqrt
 from operator import abs
+import random
 
 goal = 100          # The goal of Hog is to score 100 points.
-commentary = False # Whether to display commentary for every roll.
+observers = []      # Observers of game events; see add_observer.
+hints = True        # Whether interactive_strategy shows the best roll.
+can_fork = 'fork' in get_all_start_methods()  # False on Windows
 
 
 # Taking turns
@@ -16,17 +23,17 @@ def roll_dice(num_rolls, dice=six_sided_dice, who='Boss Hogg'):
 
     num_rolls:  The number of dice rolls that will be made; at least 1.
     dice:       A function of no args and returns an integer outcome.
-    who:        Name of the current player, for commentary.
+    who:        Name of the current player, for observers.
     """
     assert type(num_rolls) == int, 'num_rolls must be an integer.'
     assert num_rolls > 0, 'Must roll at least once.'
+    if observers:
+        return observed_roll_dice(num_rolls, dice, who)
     "*** YOUR CODE HERE ***"
     score = 0
     rolled_one = False
     while num_rolls > 0:
         roll = dice()
-        if commentary:
-            announce(roll, who)
         if roll == 1:
             rolled_one = True
               
@@ -37,22 +44,42 @@ def roll_dice(num_rolls, dice=six_sided_dice, who='Boss Hogg'):
         return 1
     else:
         return score
+
+def observed_roll_dice(num_rolls, dice, who):
+    """Roll dice like roll_dice, notifying observers of every roll."""
+    score = 0
+    rolled_one = False
+    for _ in range(num_rolls):
+        roll = dice()
+        notify('roll', roll, who)
+        if roll == 1:
+            rolled_one = True
+        score = score + roll
+    if rolled_one:
+        notify('pig_out', who)
+        return 1
+    return score
     
-def take_turn(num_rolls, opponent_score, dice=six_sided_dice, who='Boss Hogg'):
+def take_turn(num_rolls, opponent_score, dice=six_sided_dice, who='Boss Hogg',
+              bacon=None):
     """Simulate a turn in which WHO chooses to roll NUM_ROLLS, perhaps 0.
 
     num_rolls:       The number of dice rolls that will be made.
     opponent_score:  The total score of the opponent.
     dice:            A function of no args and returns an integer outcome.
-    who:             Name of the current player, for commentary.
+    who:             Name of the current player, for observers.
+    bacon:           If given, the score for rolling no dice, which replaces
+                     the usual free bacon (see make_rules).
     """
     assert type(num_rolls) == int, 'num_rolls must be an integer.'
     assert num_rolls >= 0, 'Cannot roll a negative number of dice.'
-    if commentary:
-        print(who, 'is going to roll', num_rolls, 'dice')
+    if observers:
+        notify('turn_start', who, num_rolls)
     "*** YOUR CODE HERE ***"
     if num_rolls == 0:
-        score = opponent_score // 10 + 1
+        score = opponent_score // 10 + 1 if bacon is None else bacon
+        if observers:
+            notify('free_bacon', who, score)
     else:
         score = roll_dice(num_rolls, dice, who)
     return score
@@ -85,13 +112,74 @@ def take_turn_test():
     print('Tests for roll_dice and take_turn passed.')
 
 
+# Observers
+
+def add_observer(observer):
+    """Start notifying OBSERVER of game events.
+
+    An observer is a dictionary from event names to functions.  When an event
+    happens, the function for it, if any, is called with these arguments:
+
+      'turn_start'  who, num_rolls         -- WHO is about to roll
+      'roll'        outcome, who           -- WHO rolled one die
+      'pig_out'     who                    -- WHO rolled a 1 and scores 1
+      'free_bacon'  who, points            -- WHO rolled no dice
+      'dice_swap'   player, dice           -- PLAYER must roll four-sided dice
+      'turn_end'    player, score, opponent_score, num_rolls, dice, points
+                                           -- PLAYER's turn, with the scores
+                                              from before it, is over
+      'game_end'    winner, score0, score1 -- The game is over
+
+    WHO is a player's name, while PLAYER and WINNER are 0 or 1.  Without any
+    observers, the game takes a path that never checks for them per roll.
+
+    >>> counter, counts = make_event_counter()
+    >>> add_observer(counter)
+    >>> take_turn(3, 0, make_test_dice(4, 1, 6))
+    1
+    >>> remove_observer(counter)
+    >>> counts['turn_start'], counts['roll'], counts['pig_out']
+    (1, 3, 1)
+    """
+    observers.append(observer)
+
+def remove_observer(observer):
+    """Stop notifying OBSERVER of game events."""
+    observers.remove(observer)
+
+def notify(event, *args):
+    """Call the function for EVENT of every observer with ARGS."""
+    for observer in observers:
+        if event in observer:
+            observer[event](*args)
+
+def make_event_counter():
+    """Return an observer that counts events, and the dictionary of counts,
+    from event names to the number of times they have happened.
+    """
+    counts = {}
+    def counter(event):
+        def count(*args):
+            counts[event] = counts.get(event, 0) + 1
+        return count
+    events = ['turn_start', 'roll', 'pig_out', 'free_bacon', 'dice_swap',
+              'turn_end', 'game_end']
+    return {event: counter(event) for event in events}, counts
+
+
 # Commentator
 
+def announce_turn(who, num_rolls):
+    """Print a description of WHO starting a turn of NUM_ROLLS dice."""
+    print(who, 'is going to roll', num_rolls, 'dice')
+
 def announce(outcome, who):
     """Print a description of WHO rolling OUTCOME."""
     print(who, 'rolled a', outcome)
     print(draw_number(outcome))
 
+commentator = {'turn_start': announce_turn, 'roll': announce}
+
 def draw_number(n, dot='*'):
     """Return a text representation of rolling the number N.
     If a number has multiple possible representations (such as 2 and 3), any
@@ -205,6 +293,71 @@ def select_dice(score, opponent_score):
         dice = six_sided_dice
         return dice
           
+def make_rules(goal=goal, sides=6, swap_sides=4, max_dice=10,
+               free_bacon=True, dice_cap=True, dice_swap=True):
+    """Return a ruleset of Hog, in which the rules are compiled into tables.
+
+    goal        -- The score that wins the game.
+    sides       -- Sides on the usual dice.
+    swap_sides  -- Sides on the dice rolled when the scores sum to a multiple
+                   of 7, if DICE_SWAP (see select_dice).
+    max_dice    -- Most dice a player may roll.
+    free_bacon  -- Whether rolling no dice scores opponent_score // 10 + 1
+                   (see take_turn), rather than just 1 point.
+    dice_cap    -- Whether only 1 die may be rolled when the scores sum to a
+                   number ending in 7 (see num_allowed_dice).
+    dice_swap   -- Whether dice with SWAP_SIDES sides are rolled when the
+                   scores sum to a multiple of 7, rather than the usual dice.
+
+    A ruleset is a dictionary.  Its 'allowed', 'dice' and 'bacon' entries
+    are GOAL x GOAL tables, indexed by [score][opponent_score], of the most
+    dice allowed, which dice are rolled (0 for swap dice and 1 for the usual
+    dice, like the pairs of seat_dice in play), and the score for rolling no
+    dice.  Its 'dice_sides' and 'fair_dice' entries are the sides of those
+    two dice and the dice themselves, and 'params' is a tuple of the
+    arguments to make_rules that identifies the ruleset.
+
+    >>> rules = make_rules()
+    >>> all(rules['allowed'][s][o] == num_allowed_dice(s, o) and
+    ...     rules['fair_dice'][rules['dice'][s][o]] is select_dice(s, o)
+    ...     for s in range(goal) for o in range(goal))
+    True
+    >>> rules['bacon'][12][34]
+    4
+    >>> short = make_rules(goal=50, dice_cap=False)
+    >>> len(short['allowed']), short['allowed'][7][10]
+    (50, 10)
+    """
+    assert goal >= 1 and max_dice >= 1, 'Illegal rules'
+    states = range(goal)
+    allowed = [[1 if dice_cap and (s + o) % 10 == 7 else max_dice
+                for o in states] for s in states]
+    dice = [[0 if dice_swap and (s + o) % 7 == 0 else 1 for o in states]
+            for s in states]
+    bacon = [[o // 10 + 1 if free_bacon else 1 for o in states] for s in states]
+    return {
+        'params': (goal, sides, swap_sides, max_dice, free_bacon, dice_cap,
+                   dice_swap),
+        'goal': goal,
+        'max_dice': max_dice,
+        'allowed': allowed,
+        'dice': dice,
+        'bacon': bacon,
+        'dice_sides': (swap_sides, sides),
+        'fair_dice': (_rules_dice(swap_sides), _rules_dice(sides)),
+    }
+
+def _rules_dice(sides):
+    """Return the default dice with SIDES sides, or new dice if there are
+    none.
+    """
+    for dice in (four_sided_dice, six_sided_dice):
+        if dice.sides == sides:
+            return dice
+    return make_buffered_dice(sides)
+
+standard_rules = make_rules()
+
 def other(who):
     """Return the other player, for players numbered 0 or 1.
 
@@ -224,7 +377,7 @@ def name(who):
     else:
         return 'An unknown player'
 
-def play(strategy0, strategy1):
+def play(strategy0, strategy1, seat_dice=None, rules=standard_rules):
     """Simulate a game and return 0 if the first player wins and 1 otherwise.
 
     A strategy function takes two scores for the current and opposing players.
@@ -235,9 +388,15 @@ def play(strategy0, strategy1):
 
     strategy0:  The strategy function for player 0, who plays first.
     strategy1:  The strategy function for player 1, who plays second.
+    seat_dice:  If given, a (four-sided, six-sided) pair of dice for each
+                player, which that player rolls instead of the usual dice.
+    rules:      The ruleset, from make_rules, whose tables decide how many
+                dice are allowed, which dice are rolled, and free bacon.
     """
     who = 0 # Which player is about to take a turn, 0 (first) or 1 (second)
     "*** YOUR CODE HERE ***"
+    goal, allowed, swapped = rules['goal'], rules['allowed'], rules['dice']
+    bacon, fair_dice = rules['bacon'], rules['fair_dice']
     p1score, p2score = 0, 0
     while p1score < goal and p2score < goal:
         player = name(who)        
@@ -253,24 +412,35 @@ def play(strategy0, strategy1):
             opponent_score = p1score
             num_rolls = strategy1(score, opponent_score)
 
-        allowed_rolls = num_allowed_dice(score, opponent_score)
+        allowed_rolls = allowed[score][opponent_score]
         if num_rolls > allowed_rolls:
             num_rolls = allowed_rolls
-        dice = select_dice(score, opponent_score)
-        score = take_turn(num_rolls, opponent_score, dice ,player)
+        index = swapped[score][opponent_score]
+        if seat_dice is None:
+            dice = fair_dice[index]
+        else:
+            dice = seat_dice[who][index]
+        if observers and index == 0:
+            notify('dice_swap', who, dice)
+        turn_score = take_turn(num_rolls, opponent_score, dice ,player,
+                               bacon[score][opponent_score])
+        if observers:
+            notify('turn_end', who, score, opponent_score, num_rolls, dice,
+                   turn_score)
+        score = turn_score
         
-        if score >= goal:
-            return who
-        elif who == 0:
+        if who == 0:
             p1score = p1score + score
             who = 1
         elif who == 1:
             p2score = p2score + score
             who = 0  
-    if p1score >= 100:
+    if p1score >= goal:
         who = 0
-    elif p2score >= 100:
+    elif p2score >= goal:
         who = 1
+    if observers:
+        notify('game_end', who, p1score, p2score)
     return who
 
 
@@ -294,12 +464,47 @@ def always_roll(n):
     """
     def strategy(score, opponent_score):
         return n
+    strategy.pure = True
     return strategy
 
+def compile_strategy(strategy, rules=standard_rules):
+    """Return a strategy that looks up the choices of STRATEGY in a table.
+
+    STRATEGY is called for every pair of scores below the goal of RULES, in
+    forward order and then again in reverse order.  If any call disagrees with the
+    table, STRATEGY depends on more than the scores, and compiling it fails.
+    The compiled strategy has the table as its table attribute.
+
+    >>> fast = compile_strategy(final_strategy)
+    >>> fast(50, 60) == final_strategy(50, 60), len(fast.table)
+    (True, 100)
+    >>> from random import randint
+    >>> compile_strategy(lambda score, opponent_score: randint(1, 10))
+    Traceback (most recent call last):
+    ...
+    AssertionError: Strategy is not deterministic
+    """
+    goal = rules['goal']
+    if hasattr(strategy, 'table') and len(strategy.table) == goal:
+        return strategy
+    table = [[strategy(score, opponent_score) for opponent_score in range(goal)]
+             for score in range(goal)]
+    for score in range(goal - 1, -1, -1):
+        for opponent_score in range(goal - 1, -1, -1):
+            num_rolls = table[score][opponent_score]
+            assert type(num_rolls) == int and num_rolls >= 0, \
+                'Strategy returned ' + repr(num_rolls)
+            assert strategy(score, opponent_score) == num_rolls, \
+                'Strategy is not deterministic'
+    def compiled(score, opponent_score):
+        return table[score][opponent_score]
+    compiled.table = table
+    return compiled
+
 
 # Experiments (Phase 2)
 
-def make_average(fn, num_samples=10000):
+def make_average(fn, num_samples=10000, workers=None, seed=None):
     """Return a function that returns the average_value of FN when called.
 
     To implement this function, you will have to use *args syntax, a new Python
@@ -317,6 +522,16 @@ def make_average(fn, num_samples=10000):
     - In the first, the player rolls a 3 then a 1, receiving a score of 1.
     - In the other, the player rolls a 5 and 6, scoring 11.
     Thus, the average value is 6.0.
+
+    If WORKERS or SEED is given, the samples are split into chunks of
+    chunk_size, each run with the random module and the dice seeded from SEED
+    and the chunk's position, by a pool of WORKERS processes.  The same SEED gives
+    the same average for any number of workers.  Where processes cannot be
+    forked (see can_fork), as on Windows, the chunks run in this process.
+
+    >>> avg_roll = make_average(roll_dice, 3000, seed=61)
+    >>> avg_roll(3) == make_average(roll_dice, 3000, workers=2, seed=61)(3)
+    True
     """
     "*** YOUR CODE HERE ***"
     
@@ -327,46 +542,329 @@ def make_average(fn, num_samples=10000):
             total = fn(*args) + total
             n = n - 1
         return total/num_samples
+    if workers is None and seed is None:
+        return function
+
+    def parallel_function(*args):
+        chunk_seeds = random.Random(seed)
+        chunks = []
+        for start in range(0, num_samples, chunk_size):
+            count = min(chunk_size, num_samples - start)
+            chunks.append((chunk_seeds.getrandbits(64), count))
+        return sum(_map_chunks(fn, args, chunks, workers)) / num_samples
+    return parallel_function
+
+chunk_size = 1000  # Samples per independently seeded chunk of make_average
+
+def make_adaptive_average(fn, tolerance, max_samples=100000, z=1.96,
+                          batch_size=100):
+    """Return a function that samples FN in batches of BATCH_SIZE until the
+    confidence interval of the average, Z standard errors wide on each side,
+    is within TOLERANCE of it, or until MAX_SAMPLES samples are drawn.
+
+    The function returns the average, the interval as a (low, high) pair, and
+    the number of samples drawn.
+
+    >>> avg_dice = make_adaptive_average(make_test_dice(4), 0.1)
+    >>> avg_dice()
+    (4.0, (4.0, 4.0), 100)
+    >>> avg_dice = make_adaptive_average(make_test_dice(3, 1, 5, 6), 0.1)
+    >>> average, (low, high), samples = avg_dice()
+    >>> round(average, 5), samples, round(high - low, 3)
+    (3.75, 1500, 0.194)
+    """
+    def function(*args):
+        samples, mean, squares = 0, 0, 0  # Welford's running variance
+        half_width = inf
+        while half_width > tolerance and samples < max_samples:
+            for _ in range(min(batch_size, max_samples - samples)):
+                value = fn(*args)
+                samples += 1
+                delta = value - mean
+                mean += delta / samples
+                squares += delta * (value - mean)
+            if samples > 1:
+                half_width = z * sqrt(squares / (samples - 1) / samples)
+        return mean, (mean - half_width, mean + half_width), samples
     return function
-        
-def compare_strategies(strategy, baseline=always_roll(5)):
-    """Return the average win rate (out of 1) of STRATEGY against BASELINE."""
-    as_first = 1 - make_average(play)(strategy, baseline)
-    as_second = make_average(play)(baseline, strategy)
+
+_chunk_fn, _chunk_args = None, None
+
+def _map_chunks(fn, args, chunks, workers):
+    """Return the totals of FN(*ARGS) over each (seed, count) chunk in CHUNKS,
+    using a pool of WORKERS processes if WORKERS is more than 1.
+
+    Worker processes are forked, so that they inherit FN and ARGS even if FN
+    is a closure that cannot be pickled.  Without can_fork, every chunk runs
+    in this process.
+    """
+    global _chunk_fn, _chunk_args
+    _chunk_fn, _chunk_args = fn, args
+    if workers is None or workers <= 1 or not can_fork:
+        states = [d.getstate() for d in (four_sided_dice, six_sided_dice)]
+        state = random.getstate()
+        try:
+            return [_total_chunk(chunk) for chunk in chunks]
+        finally:
+            random.setstate(state)
+            four_sided_dice.setstate(states[0])
+            six_sided_dice.setstate(states[1])
+    with get_context('fork').Pool(workers) as pool:
+        return pool.map(_total_chunk, chunks)
+
+def _total_chunk(chunk):
+    """Return the total of COUNT calls to the function being averaged, after
+    seeding the random module and both kinds of dice from SEED, where CHUNK
+    is (SEED, COUNT).
+    """
+    chunk_seed, count = chunk
+    random.seed(chunk_seed)
+    four_sided_dice.seed(random.getrandbits(64))
+    six_sided_dice.seed(random.getrandbits(64))
+    total = 0
+    for _ in range(count):
+        total = _chunk_fn(*_chunk_args) + total
+    return total
+
+def compare_strategies(strategy, baseline=always_roll(5), workers=None,
+                       seed=None, num_samples=10000, tolerance=None):
+    """Return the average win rate (out of 1) of STRATEGY against BASELINE.
+
+    NUM_SAMPLES games are played in each seat.  WORKERS and SEED are passed
+    on to make_average.  If TOLERANCE is given, games are instead played in
+    each seat until the win rate is known to within TOLERANCE (see
+    make_adaptive_average), ignoring WORKERS and SEED.
+    """
+    if tolerance is not None:
+        average_play = make_adaptive_average(play, tolerance)
+        as_first = 1 - average_play(strategy, baseline)[0]
+        as_second = average_play(baseline, strategy)[0]
+        return (as_first + as_second) / 2
+    second_seed = None if seed is None else seed + 1
+    average_play = make_average(play, num_samples, workers, seed)
+    as_first = 1 - average_play(strategy, baseline)
+    average_play = make_average(play, num_samples, workers, second_seed)
+    as_second = average_play(baseline, strategy)
     return (as_first + as_second) / 2  # Average the two results
 
-def eval_strategy_range(make_strategy, lower_bound, upper_bound):
+def compare_strategies_paired(strategy, baseline=always_roll(5),
+                              num_samples=10000, seed=None, antithetic=False):
+    """Return the average win rate (out of 1) of STRATEGY against BASELINE,
+    and the factor by which pairing games reduced the variance of that rate.
+
+    Each game in which STRATEGY goes first is paired with a game in which
+    BASELINE goes first (common random numbers).  In both games, the first
+    player rolls dice from one pair of seeded streams and the second player
+    from another, so luck that favors one seat mostly cancels out.  If
+    ANTITHETIC is true, every other pair of games replays the pair before it
+    with mirrored dice, and a last pair without a partner stands alone.
+    At least 2 samples, or 3 if ANTITHETIC, are needed to estimate the
+    variance.
+
+    >>> rate, reduction = compare_strategies_paired(always_roll(5), seed=1,
+    ...                                             num_samples=200)
+    >>> rate, reduction
+    (0.5, inf)
+    >>> rate, reduction = compare_strategies_paired(always_roll(4), seed=3,
+    ...                                             num_samples=101,
+    ...                                             antithetic=True)
+    >>> rate == 98 / 202, reduction > 1
+    (True, True)
+    """
+    assert num_samples >= (3 if antithetic else 2), \
+        'Too few samples to estimate the variance of the win rate'
+    pair_seeds = random.Random(seed)
+    seat_dice = [(make_buffered_dice(4, block_size=paired_block_size),
+                  make_buffered_dice(6, block_size=paired_block_size))
+                 for _ in range(2)]
+    as_first, as_second = [], []
+    for index in range(num_samples):
+        mirror = antithetic and index % 2 == 1
+        if not mirror:
+            dice_seeds = [pair_seeds.getrandbits(64) for _ in range(4)]
+        for players in ((strategy, baseline), (baseline, strategy)):
+            for dice, dice_seed in zip(seat_dice[0] + seat_dice[1], dice_seeds):
+                dice.seed(dice_seed, mirror)
+            winner = play(*players, seat_dice=seat_dice)
+            if players[0] is strategy:
+                as_first.append(1 - winner)
+            else:
+                as_second.append(winner)
+
+    group = 2 if antithetic else 1
+    units = []
+    for i in range(0, num_samples, group):
+        games = as_first[i:i + group] + as_second[i:i + group]
+        units.append(sum(games) / len(games))
+    paired = _variance(units) / len(units)
+    unpaired = (_variance(as_first) + _variance(as_second)) / (4 * num_samples)
+    reduction = unpaired / paired if paired else inf
+    return (sum(as_first) + sum(as_second)) / (2 * num_samples), reduction
+
+paired_block_size = 50  # Dice are reseeded every game, so keep blocks short
+
+def _variance(values):
+    """Return the sample variance of a list of VALUES."""
+    mean = sum(values) / len(values)
+    return sum((v - mean) ** 2 for v in values) / (len(values) - 1)
+
+def eval_strategy_range(make_strategy, lower_bound, upper_bound, workers=None,
+                        seed=None, race=False, num_samples=10000,
+                        cache_file=None):
     """Return the best integer argument value for MAKE_STRATEGY to use against
     the always-roll-5 baseline, between LOWER_BOUND and UPPER_BOUND (inclusive).
 
     make_strategy -- A one-argument function that returns a strategy.
     lower_bound -- lower bound of the evaluation range.
     upper_bound -- upper bound of the evaluation range.
+    workers -- number of processes for each comparison (see make_average).
+    seed -- seed for the dice of each comparison (see make_average).
+    race -- whether to drop clearly losing values early (see race_strategy_range).
+    num_samples -- games played in each seat for each value.
+    cache_file -- if given, a cache file of win rates (see cache.py).  A value
+                  is only evaluated if the file has no win rate for the same
+                  roll table, value, NUM_SAMPLES, SEED and rules, and the file
+                  is saved after each value, so an interrupted range resumes
+                  from the last value it finished.  Races, and ranges
+                  without a SEED, are never cached, since an unseeded
+                  comparison gives a different result every time.
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'experiments.json')
+    >>> eval_strategy_range(always_roll, 4, 5, seed=1, num_samples=100,
+    ...                     cache_file=path)
+    Win rate against the baseline using 4 value: 0.49
+    Win rate against the baseline using 5 value: 0.525
+    5
+    >>> eval_strategy_range(always_roll, 4, 6, seed=1, num_samples=100,
+    ...                     cache_file=path)
+    Win rate against the baseline using 4 value: 0.49
+    Win rate against the baseline using 5 value: 0.525
+    Win rate against the baseline using 6 value: 0.495
+    5
+    >>> len(load_results(path))
+    3
+    >>> from contextlib import redirect_stdout
+    >>> with redirect_stdout(None):
+    ...     best = eval_strategy_range(always_roll, 7, 7, num_samples=10,
+    ...                                cache_file=path)
+    >>> len(load_results(path))
+    3
     """
+    if race:
+        best_value, games = race_strategy_range(make_strategy, lower_bound,
+                                                upper_bound, workers=workers,
+                                                seed=seed)
+        for value, num_games in sorted(games.items()):
+            print('Games played against the baseline using', value, 'value:',
+                  num_games)
+        return best_value
+    cached = cache_file and seed is not None
+    results = load_results(cache_file) if cached else {}
     best_value, best_win_rate = 0, 0
     value = lower_bound
     while value <= upper_bound:
         strategy = make_strategy(value)
-        win_rate = compare_strategies(strategy)
+        key = None
+        if cached:
+            key = experiment_key(strategy, value, num_samples, seed)
+        if key in results:
+            win_rate = results[key]
+        else:
+            win_rate = compare_strategies(strategy, workers=workers, seed=seed,
+                                          num_samples=num_samples)
+            if key:
+                results[key] = win_rate
+                save_results(cache_file, results)
         print('Win rate against the baseline using', value, 'value:', win_rate)
         if win_rate > best_win_rate:
             best_win_rate, best_value = win_rate, value
         value += 1
     return best_value
 
+def experiment_key(strategy, value, num_samples, seed):
+    """Return the cache key of comparing STRATEGY, made from VALUE, against
+    the always-roll-5 baseline with NUM_SAMPLES games per seat and SEED.
+    """
+    rules = '/'.join(str(param) for param in standard_rules['params'])
+    table = compile_strategy(strategy).table
+    return ':'.join(['compare_strategies', table_hash(table), str(value),
+                     str(num_samples), str(seed), rules])
+
+def race_strategy_range(make_strategy, lower_bound, upper_bound,
+                        round_size=1000, max_games=20000, z=2.576,
+                        workers=None, seed=None):
+    """Return the best integer argument value for MAKE_STRATEGY between
+    LOWER_BOUND and UPPER_BOUND (inclusive), and a dictionary from each value
+    to the number of games it played against the always-roll-5 baseline.
+
+    Values race in rounds of ROUND_SIZE games, half in each seat.  After each
+    round, a value is dropped once the upper end of its confidence interval
+    (Z standard errors) falls below the lower end of the leader's.  The race
+    ends when one value is left or the others have played MAX_GAMES games,
+    the same number that eval_strategy_range gives every value.
+    """
+    assert round_size % 2 == 0, 'Rounds must split evenly between the seats'
+    strategies, wins, games = {}, {}, {}
+    for value in range(lower_bound, upper_bound + 1):
+        strategies[value] = make_strategy(value)
+        wins[value], games[value] = 0, 0
+    round_seeds = random.Random(seed)
+
+    def win_rate(value):
+        return wins[value] / games[value]
+
+    def half_width(value):
+        p = win_rate(value)
+        return z * sqrt(p * (1 - p) / games[value])
+
+    alive = list(strategies)
+    while len(alive) > 1 and games[alive[0]] < max_games:
+        for value in alive:
+            round_seed = None if seed is None else round_seeds.getrandbits(64)
+            rate = compare_strategies(strategies[value], workers=workers,
+                                      seed=round_seed,
+                                      num_samples=round_size // 2)
+            wins[value] += rate * round_size
+            games[value] += round_size
+        leader_lower = max(win_rate(v) - half_width(v) for v in alive)
+        alive = [v for v in alive if win_rate(v) + half_width(v) >= leader_lower]
+    return max(alive, key=win_rate), games
+
+experiment_seed = 61  # Seed of the dice in run_experiments
+
 def run_experiments():
-    """Run a series of strategy experiments and report results."""
-    result = eval_strategy_range(always_roll, 1, 10)
+    """Run a series of strategy experiments and report results.
+
+    Win rates are cached in experiments_cache.json, so running the
+    experiments again only evaluates strategies that have changed.  Every
+    experiment uses experiment_seed, so a cached win rate is the one the
+    experiment would compute again.
+    """
+    experiments = cache_path('experiments')
+    result = eval_strategy_range(always_roll, 1, 10, seed=experiment_seed,
+                                 cache_file=experiments)
     print('Best always_roll strategy:', result)
 
     if False: # Change to True when ready to test make_comeback_strategy
-        result = eval_strategy_range(make_comeback_strategy, 1, 30)
+        result = eval_strategy_range(make_comeback_strategy, 1, 30,
+                                     seed=experiment_seed,
+                                     cache_file=experiments)
         print('Best comeback strategy:', result)
 
     if True: # Change to True when ready to test make_mean_strategy
-        result = eval_strategy_range(make_mean_strategy, 1, 30)
+        result = eval_strategy_range(make_mean_strategy, 1, 30,
+                                     seed=experiment_seed,
+                                     cache_file=experiments)
         print('Best mean strategy:', result)
 
+    if True: # Exact turn scores from solver.py, instead of make_average
+        from solver import expected_turn_score, turn_score_variance
+        for num_rolls in range(1, 11):
+            print('Rolling', num_rolls, 'dice scores on average',
+                  expected_turn_score(num_rolls), 'with variance',
+                  turn_score_variance(num_rolls))
+
     "*** You may add additional experiments here if you wish ***"
     
 # Strategies
@@ -374,24 +872,138 @@ def run_experiments():
 def make_comeback_strategy(margin, num_rolls=5):
     """Return a strategy that rolls one extra time when losing by MARGIN."""
     "*** YOUR CODE HERE ***"
-    def function(score, opponent_score):
-        n = num_rolls
-        if ( opponent_score - score ) >= margin:           
-            n = num_rolls + 1
-        return n
-    return function
+    return when(trailing_by(margin), num_rolls + 1, num_rolls)
 
 def make_mean_strategy(min_points, num_rolls=5):
     """Return a strategy that attempts to give the opponent problems."""
     "*** YOUR CODE HERE ***"
-    def function(score, opponent_score):
+    return override(num_rolls, bacon_hampers(min_points), 0)
+
+
+# Strategy combinators
+
+def _mark_pure(fn, *parts):
+    """Mark FN as pure if all of its PARTS are pure, and return it.
+
+    A pure strategy or condition depends only on the two scores, so a
+    strategy built only from pure parts can be collapsed into a roll table.
+    """
+    fn.pure = all(getattr(part, 'pure', False) for part in parts)
+    return fn
+
+def _as_strategy(strategy):
+    """Return STRATEGY, or a strategy that always rolls it if it is a number."""
+    if type(strategy) == int:
+        return always_roll(strategy)
+    return strategy
+
+def leading_by(margin):
+    """Return a condition that holds when ahead by at least MARGIN points.
+
+    A condition is a function that takes the two game scores, like a
+    strategy, and returns whether it holds.
+    """
+    def condition(score, opponent_score):
+        return score - opponent_score >= margin
+    return _mark_pure(condition)
+
+def trailing_by(margin):
+    """Return a condition that holds when behind by at least MARGIN points."""
+    def condition(score, opponent_score):
+        return opponent_score - score >= margin
+    return _mark_pure(condition)
+
+def bacon_wins():
+    """Return a condition that holds when free bacon reaches the goal."""
+    def condition(score, opponent_score):
+        return score + opponent_score // 10 + 1 >= goal
+    return _mark_pure(condition)
+
+def bacon_hampers(min_points=1):
+    """Return a condition that holds when free bacon scores at least
+    MIN_POINTS and leaves the opponent with a dice limit or four-sided dice.
+    """
+    def condition(score, opponent_score):
         free_bacon = opponent_score // 10 + 1
-        if (min_points <= free_bacon) and (((score + free_bacon + opponent_score)%10 == 7) or ((score + free_bacon + opponent_score)%7 == 0)):
-            return 0
-        else:
-            return num_rolls
-    return function
+        total = score + free_bacon + opponent_score
+        return free_bacon >= min_points and (total % 10 == 7 or total % 7 == 0)
+    return _mark_pure(condition)
+
+def either(condition0, condition1):
+    """Return a condition that holds when either condition holds."""
+    def condition(score, opponent_score):
+        return (condition0(score, opponent_score) or
+                condition1(score, opponent_score))
+    return _mark_pure(condition, condition0, condition1)
+
+def when(condition, then, otherwise):
+    """Return a strategy that plays THEN when CONDITION holds and OTHERWISE
+    when it does not.  THEN and OTHERWISE are strategies or numbers of dice.
+
+    >>> strategy = when(trailing_by(10), 6, always_roll(4))
+    >>> strategy(30, 45), strategy(30, 35), strategy.pure
+    (6, 4, True)
+    """
+    then, otherwise = _as_strategy(then), _as_strategy(otherwise)
+    def strategy(score, opponent_score):
+        if condition(score, opponent_score):
+            return then(score, opponent_score)
+        return otherwise(score, opponent_score)
+    return _mark_pure(strategy, condition, then, otherwise)
+
+def choose(cases, otherwise):
+    """Return a strategy that plays the strategy of the first (condition,
+    strategy) pair in CASES whose condition holds, or OTHERWISE if none do.
+
+    >>> strategy = choose([(leading_by(30), 3), (leading_by(10), 4)], 5)
+    >>> strategy(50, 10), strategy(50, 30), strategy(50, 45)
+    (3, 4, 5)
+    """
+    for condition, then in reversed(cases):
+        otherwise = when(condition, then, otherwise)
+    return _as_strategy(otherwise)
+
+def by_lead(leading, trailing):
+    """Return a strategy that plays LEADING when ahead and TRAILING when tied
+    or behind.
+    """
+    return when(leading_by(1), leading, trailing)
+
+def plus(strategy, extra):
+    """Return a strategy that rolls EXTRA more dice than STRATEGY."""
+    strategy = _as_strategy(strategy)
+    def more(score, opponent_score):
+        return strategy(score, opponent_score) + extra
+    return _mark_pure(more, strategy)
+
+def override(strategy, condition, num_rolls):
+    """Return a strategy that plays STRATEGY, except that it rolls NUM_ROLLS
+    dice when CONDITION holds.
+    """
+    return when(condition, num_rolls, strategy)
+
+def collapse(strategy):
+    """Return a compiled strategy that looks up the choices of STRATEGY in a
+    roll table if STRATEGY is pure, or STRATEGY itself otherwise.
 
+    >>> collapse(by_lead(4, 6)).table[20][10]
+    4
+    >>> impure = when(lambda score, opponent_score: random.random() < 0.5, 4, 6)
+    >>> collapse(impure) is impure
+    True
+    """
+    if getattr(strategy, 'pure', False):
+        return compile_strategy(strategy)
+    return strategy
+
+
+# Final strategy
+
+margin_rolls = choose([(trailing_by(40), 8), (trailing_by(24), 7),
+                       (leading_by(30), 3), (leading_by(12), 4)], 5)
+comeback_rolls = when(trailing_by(7), plus(margin_rolls, 1), margin_rolls)
+final_rolls = collapse(override(comeback_rolls,
+                                either(bacon_wins(), bacon_hampers(5)), 0))
 
 def final_strategy(score, opponent_score):
     """Final strategy that implements a few rules that will ensure 60+% winrate against the basic strategy 
@@ -399,37 +1011,19 @@ def final_strategy(score, opponent_score):
     *** YOUR DESCRIPTION HERE ***
     Implements make mean strategy and two forms of comeback strategy. Also implements checks to see if we can win in one turn by using
     free bacon rule. Also strategy takes less risks when in the lead. 
-    
+
+    The rules are combined once, into final_rolls, and collapsed into a roll
+    table, so each call is a single lookup.
     """
     "*** YOUR CODE HERE ***"
+    return final_rolls(score, opponent_score)
 
-    n = 5
-    score_loop, opponent_score_loop = 90, 90
-
-    while score_loop != 100: #this will check for one turn win by taking advantage of the free bacon rule
-        
-        if opponent_score >= opponent_score_loop and score >= score_loop:
-            return 0
-        score_loop += 1
-        opponent_score_loop -= 10
-   
-
-    if (score - opponent_score) >= 12: #win margin
-        n = 4
-    if (score - opponent_score) >= 30: #win margin
-        n = 3 
-    if (opponent_score - score) >= 24: #lose margin
-        n = 7
-    if (opponent_score - score) >= 40: #lose margin
-        n = 8
-    n = make_comeback_strategy(7, n)(score, opponent_score) #lose margin
-    n = make_mean_strategy(5,n)(score, opponent_score) #implement take advantage of rules
-    return n
+final_strategy.table, final_strategy.pure = final_rolls.table, True
 
 def final_strategy_test():
     """Compares final strategy to the baseline strategy."""
     print('-- Testing final_strategy --')
-    print('Win rate:', compare_strategies(final_strategy))
+    print('Win rate:', compare_strategies(compile_strategy(final_strategy)))
 
 
 
@@ -438,9 +1032,17 @@ def final_strategy_test():
 def interactive_strategy(score, opponent_score):
     """Prints total game scores and returns an interactive tactic.
 
+    If hints is true, it also prints the best number of dice against an
+    optimal opponent, looked up in the precomputed tables of service.py.
+
     This function uses Python syntax/techniques not yet covered in this course.
     """
     print('Current score:', score, 'to', opponent_score)
+    if hints:
+        from service import query
+        win, rolls = query(score, opponent_score)
+        print('Hint: rolling', rolls, 'dice wins {0:.1%} of the time'.format(win),
+              'against an optimal opponent')
     while True:
         response = input('How many dice will you roll? ')
         try:
@@ -455,10 +1057,12 @@ def interactive_strategy(score, opponent_score):
 
 def play_interactively():
     """Play one interactive game."""
-    global commentary
-    commentary = True
     print("Shall we play a game?")
-    winner = play(interactive_strategy, always_roll(5))
+    add_observer(commentator)
+    try:
+        winner = play(interactive_strategy, always_roll(5))
+    finally:
+        remove_observer(commentator)
     if winner == 0:
         print("You win!")
     else:
@@ -466,9 +1070,11 @@ def play_interactively():
 
 def play_basic():
     """Play one game in which two basic strategies compete."""
-    global commentary
-    commentary = True
-    winner = play(always_roll(5), always_roll(6))
+    add_observer(commentator)
+    try:
+        winner = play(always_roll(5), always_roll(6))
+    finally:
+        remove_observer(commentator)
     if winner == 0:
         print("Player 0, who always wants to roll 5, won.")
     else:
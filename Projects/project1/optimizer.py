@@ -0,0 +1,131 @@
+"""Search for strong Hog strategies.
+
+optimize_table improves a whole roll table by local search: every step
+proposes a batch of mutated tables, scores them all against an opponent
+(exactly, by default, using solver.exact_compare), and keeps the best one if
+it beats the current table.  optimize_parameters searches a family of
+strategies that take integer parameters, such as make_comeback_strategy,
+one parameter at a time.
+"""
+
+import os
+import random
+from multiprocessing import get_context
+from time import time
+
+from hog import always_roll, can_fork, compile_strategy, goal
+from solver import exact_compare, max_rolls
+
+def table_strategy(table):
+    """Return a compiled strategy that rolls the dice in roll TABLE.
+
+    >>> strategy = table_strategy([[3] * 100] * 100)
+    >>> strategy(12, 34)
+    3
+    """
+    rows = [list(row) for row in table]
+    return compile_strategy(lambda score, opponent_score:
+                            rows[score][opponent_score])
+
+def optimize_table(opponent=always_roll(5), start=None, time_budget=60,
+                   workers=None, seed=None, evaluate=exact_compare):
+    """Return a strategy found by local search over roll tables, and its win
+    rate against OPPONENT.
+
+    opponent -- the strategy to beat.
+    start -- the strategy to start from; OPPONENT by default.
+    time_budget -- seconds to keep searching.
+    workers -- processes that score candidates; all cores by default.
+               Candidates are scored in this process if processes cannot
+               be forked (see hog.can_fork).
+    seed -- seed for the mutations.
+    evaluate -- a function of two roll tables that returns a win rate.
+
+    >>> strategy, rate = optimize_table(time_budget=1, workers=1, seed=1)
+    >>> rate >= 0.5
+    True
+    """
+    rng = random.Random(seed)
+    workers = workers or os.cpu_count()
+    opponent_table = compile_strategy(opponent).table
+    table = [list(row) for row in compile_strategy(start or opponent).table]
+    best_rate = evaluate(table, opponent_table)
+    deadline = time() + time_budget
+    pool = None
+    if workers > 1 and can_fork:
+        pool = get_context('fork').Pool(workers)
+    try:
+        while time() < deadline:
+            candidates = [_mutate(table, rng) for _ in range(workers)]
+            jobs = [(evaluate, c, opponent_table) for c in candidates]
+            if pool is None:
+                rates = [_score(job) for job in jobs]
+            else:
+                rates = pool.map(_score, jobs)
+            rate, index = max((r, i) for i, r in enumerate(rates))
+            if rate > best_rate:
+                best_rate, table = rate, candidates[index]
+    finally:
+        if pool is not None:
+            pool.terminate()
+    return table_strategy(table), best_rate
+
+def _score(job):
+    """Return the win rate of a table against another, where JOB is an
+    (evaluate, table, other_table) triple.
+    """
+    evaluate, table, other_table = job
+    return evaluate(table, other_table)
+
+def _mutate(table, rng):
+    """Return a copy of TABLE in which a random square block of states rolls
+    one more or one fewer die, or a random state rolls no dice at all.
+    """
+    table = [list(row) for row in table]
+    score, opponent_score = rng.randrange(goal), rng.randrange(goal)
+    if rng.random() < 0.2:
+        table[score][opponent_score] = 0
+        return table
+    size = rng.randint(1, 20)
+    change = rng.choice((-1, 1))
+    for s in range(score, min(score + size, goal)):
+        for o in range(opponent_score, min(opponent_score + size, goal)):
+            table[s][o] = min(max(table[s][o] + change, 0), max_rolls)
+    return table
+
+def optimize_parameters(make_strategy, ranges, opponent=always_roll(5),
+                        time_budget=60, evaluate=exact_compare):
+    """Return the best parameters for MAKE_STRATEGY, found by changing one
+    parameter at a time while that improves the win rate against OPPONENT,
+    and that win rate.
+
+    make_strategy -- a function of integer parameters that returns a strategy.
+    ranges -- a list of (lower, upper) bounds on each parameter, inclusive.
+
+    >>> from hog import make_comeback_strategy
+    >>> optimize_parameters(make_comeback_strategy, [(1, 3), (5, 5)],
+    ...                     time_budget=10)[0]
+    [3, 5]
+    """
+    opponent_table = compile_strategy(opponent).table
+    rates = {}
+
+    def rate(params):
+        if params not in rates:
+            table = compile_strategy(make_strategy(*params)).table
+            rates[params] = evaluate(table, opponent_table)
+        return rates[params]
+
+    best = tuple(lower for lower, _ in ranges)
+    deadline = time() + time_budget
+    improved = True
+    while improved and time() < deadline:
+        improved = False
+        for index, (lower, upper) in enumerate(ranges):
+            for value in range(lower, upper + 1):
+                params = best[:index] + (value,) + best[index + 1:]
+                if rate(params) > rate(best):
+                    best, improved = params, True
+                if time() >= deadline:
+                    break
+    return list(best), rate(best)
@@ -0,0 +1,157 @@
+"""Answer queries about the chance of winning from Hog states.
+
+The optimal win rates and roll counts of every state, from solver.solve, are
+computed once, stored in optimal_cache.json, and loaded from there by later
+runs.  Queries are answered from those tables in this process with query and
+query_many, or by a local server started with serve:
+
+    python3 service.py --port 6161
+
+Each line sent to the server holds any number of score, opponent_score
+pairs, and the server answers with one line that holds a win rate and a
+number of dice for each pair, so a batch of states costs one round trip.
+"""
+
+import asyncio
+
+import solver
+from cache import cache_path, file_hash, load_results, save_results
+from hog import standard_rules
+from ucb import main
+
+default_host = '127.0.0.1'
+default_port = 6161
+
+_tables = {}  # The tables loaded from each cache file
+
+def state_tables(path=None):
+    """Return the WIN and ROLLS tables of solver.solve for the standard
+    rules, loaded from the cache file at PATH (optimal_cache.json by default)
+    the first time, or solved and stored there if the file lacks them.
+
+    Tables are stored under a hash of solver.py as well as the rules, so a
+    change to the solver is never answered with tables it did not compute.
+    """
+    path = path or cache_path('optimal')
+    if path not in _tables:
+        rules = '/'.join(str(param) for param in standard_rules['params'])
+        key = ':'.join(['solve', file_hash(solver.__file__), rules])
+        results = load_results(path)
+        if key not in results:
+            win, rolls = solver.solve()
+            results[key] = {'win': win, 'rolls': rolls}
+            save_results(path, results)
+        _tables[path] = results[key]['win'], results[key]['rolls']
+    return _tables[path]
+
+def query(score, opponent_score):
+    """Return the chance that the player about to roll at SCORE wins against
+    an optimal opponent at OPPONENT_SCORE, and the number of dice to roll.
+
+    >>> win, rolls = query(0, 0)
+    >>> round(win, 4), rolls
+    (0.5026, 5)
+    """
+    win, rolls = state_tables()
+    return win[score][opponent_score], rolls[score][opponent_score]
+
+def query_many(states):
+    """Return a list of the answers of query for a sequence of (score,
+    opponent_score) STATES.
+
+    >>> [rolls for _, rolls in query_many([(0, 0), (99, 0)])]
+    [5, 0]
+    """
+    win, rolls = state_tables()
+    return [(win[s][o], rolls[s][o]) for s, o in states]
+
+
+# Server
+
+def answer(line):
+    """Return the reply to a query LINE of score, opponent_score pairs.
+
+    >>> answer('0 0 99 0')
+    '0.502575 5 1.000000 0'
+    >>> answer('0 0 99')
+    'error: expected pairs of scores'
+    """
+    try:
+        numbers = [int(n) for n in line.split()]
+        if len(numbers) % 2 or min(numbers, default=0) < 0:
+            raise ValueError
+        results = query_many(zip(numbers[::2], numbers[1::2]))
+    except ValueError:
+        return 'error: expected pairs of scores'
+    except IndexError:
+        return 'error: scores must be below the goal'
+    return ' '.join('{0:.6f} {1}'.format(w, n) for w, n in results)
+
+async def _handle(reader, writer):
+    """Answer each line from READER on WRITER until the client disconnects."""
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            writer.write((answer(line.decode()) + '\n').encode())
+            await writer.drain()
+    finally:
+        writer.close()
+
+async def start_server(host=default_host, port=default_port):
+    """Load the state tables and return a running asyncio server of queries
+    at HOST and PORT.
+    """
+    state_tables()
+    return await asyncio.start_server(_handle, host, port)
+
+async def ask(states, host=default_host, port=default_port):
+    """Return the answers of the server at HOST and PORT for a sequence of
+    (score, opponent_score) STATES, like query_many.
+
+    >>> async def ask_once():
+    ...     server = await start_server(port=0)
+    ...     port = server.sockets[0].getsockname()[1]
+    ...     answers = await ask([(0, 0), (40, 60)], port=port)
+    ...     server.close()
+    ...     await server.wait_closed()
+    ...     return answers
+    >>> answers = asyncio.run(ask_once())
+    >>> answers == [(round(w, 6), n) for w, n in query_many([(0, 0), (40, 60)])]
+    True
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        line = ' '.join('{0} {1}'.format(s, o) for s, o in states)
+        writer.write((line + '\n').encode())
+        await writer.drain()
+        reply = (await reader.readline()).decode().split()
+    finally:
+        writer.close()
+        await writer.wait_closed()
+    if reply and reply[0] == 'error:':
+        raise ValueError(' '.join(reply[1:]))
+    return [(float(w), int(n)) for w, n in zip(reply[::2], reply[1::2])]
+
+def serve(host=default_host, port=default_port):
+    """Answer queries at HOST and PORT until interrupted."""
+    async def serve_forever():
+        server = await start_server(host, port)
+        async with server:
+            await server.serve_forever()
+    asyncio.run(serve_forever())
+
+@main
+def run(*args):
+    """Serve queries about Hog states.
+
+    This function uses Python syntax/techniques not yet covered in this course.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description="Serve Hog win rates")
+    parser.add_argument('--host', default=default_host)
+    parser.add_argument('--port', '-p', type=int, default=default_port)
+    args = parser.parse_args()
+    print('Serving Hog win rates at', args.host, 'port', args.port)
+    serve(args.host, args.port)
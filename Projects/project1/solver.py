@@ -0,0 +1,250 @@
+"""Exact analysis of the Game of Hog.
+
+Instead of estimating win rates by sampling games, the functions in this
+module compute the probability of winning from every (score, opponent_score)
+state directly, using the same rules that hog.play enforces:
+
+ -  Rolling any 1 makes the whole turn score 1 (roll_dice).
+ -  Rolling zero dice scores the free bacon in the 'bacon' table of a
+    ruleset from hog.make_rules.
+ -  No more dice may be rolled than its 'allowed' table permits.
+ -  The dice rolled are the ones its 'dice' table selects.
+
+Every function takes the ruleset as its RULES argument, which defaults to
+the standard rules of hog.standard_rules.
+"""
+
+from hog import compile_strategy, standard_rules
+from operator import mul
+
+max_rolls = 10           # No rule ever allows more than 10 dice.
+max_turn_score = 6 * max_rolls
+tolerance = 1e-12        # Rolling more dice must beat fewer by this much.
+
+
+# Turn outcomes
+
+_distributions = {}
+
+def turn_distribution(num_rolls, sides=6):
+    """Return a tuple P of length max_turn_score + 1, in which P[k] is the
+    probability that roll_dice(NUM_ROLLS, dice) scores k for a fair die with
+    SIDES sides.
+
+    The distributions for every number of rolls are computed together, once
+    per kind of dice, by convolving one more die at a time.
+
+    >>> p = turn_distribution(1)
+    >>> [round(p[k], 4) for k in range(7)]
+    [0.0, 0.1667, 0.1667, 0.1667, 0.1667, 0.1667, 0.1667]
+    >>> round(sum(turn_distribution(10, 4)), 10)
+    1.0
+    >>> turn_distribution(3, 4) is turn_distribution(3, 4)
+    True
+    """
+    assert 1 <= num_rolls <= max_rolls, 'Cannot roll ' + str(num_rolls)
+    if sides not in _distributions:
+        _distributions[sides] = _convolve_rolls(sides)
+    return _distributions[sides][num_rolls]
+
+def _convolve_rolls(sides):
+    """Return a list whose element n is the turn distribution for N rolls."""
+    assert max_turn_score >= sides * max_rolls, 'Dice have too many sides'
+    dists = [None]
+    no_ones = [1.0]  # Distribution of the sum of dice that avoided a 1
+    for _ in range(max_rolls):
+        rolled = [0.0] * (len(no_ones) + sides)
+        for total, p in enumerate(no_ones):
+            if p:
+                for outcome in range(2, sides + 1):
+                    rolled[total + outcome] += p / sides
+        no_ones = rolled
+        dist = [0.0] * (max_turn_score + 1)
+        dist[:len(no_ones)] = no_ones
+        dist[1] = 1 - sum(no_ones)
+        dists.append(tuple(dist))
+    return dists
+
+def expected_turn_score(num_rolls, sides=6):
+    """Return the exact average of roll_dice(NUM_ROLLS, dice).
+
+    >>> round(expected_turn_score(1), 4)
+    3.5
+    >>> round(expected_turn_score(2), 4)
+    5.8611
+    """
+    return sum(map(mul, turn_distribution(num_rolls, sides), _scores))
+
+def turn_score_variance(num_rolls, sides=6):
+    """Return the exact variance of roll_dice(NUM_ROLLS, dice).
+
+    >>> round(turn_score_variance(1), 4)
+    2.9167
+    """
+    mean = expected_turn_score(num_rolls, sides)
+    squares = sum(p * k * k for k, p in
+                  enumerate(turn_distribution(num_rolls, sides)))
+    return squares - mean * mean
+
+def turn_score_at_least(points, num_rolls, sides=6):
+    """Return the probability that roll_dice(NUM_ROLLS, dice) scores at least
+    POINTS.
+
+    >>> round(turn_score_at_least(2, 1), 4)
+    0.8333
+    >>> turn_score_at_least(25, 4)
+    0.0
+    """
+    return sum(turn_distribution(num_rolls, sides)[max(points, 0):])
+
+_scores = range(max_turn_score + 1)
+
+def _check_rules(rules):
+    """Assert that every turn under RULES fits in a turn distribution."""
+    most_sides = max(rules['dice_sides'])
+    assert rules['max_dice'] <= max_rolls, 'Rules allow too many dice'
+    assert most_sides * rules['max_dice'] <= max_turn_score, \
+        'Rules allow too many points per turn'
+
+def _row_size(rules):
+    """Return the length of a row of chances of winning after moving to each
+    score, which must reach past the most points of any turn under RULES.
+
+    >>> from hog import make_rules
+    >>> _row_size(make_rules()), _row_size(make_rules(goal=700))
+    (161, 771)
+    """
+    most_bacon = max(max(row) for row in rules['bacon'])
+    return rules['goal'] + max(max_turn_score, most_bacon) + 1
+
+def _chance(score, opponent_score, num_rolls, after, rules):
+    """Return the chance of winning by rolling NUM_ROLLS dice under RULES,
+    where AFTER[s] is the chance of winning after moving to score s.
+    """
+    if num_rolls == 0:
+        return after[score + rules['bacon'][score][opponent_score]]
+    index = rules['dice'][score][opponent_score]
+    dist = turn_distribution(num_rolls, rules['dice_sides'][index])
+    return sum(map(mul, dist, after[score:score + max_turn_score + 1]))
+
+
+# Optimal play
+
+def solve(rules=standard_rules):
+    """Return two GOAL x GOAL tables, WIN and ROLLS, for optimal play.
+
+    WIN[score][opponent_score] is the probability that the player about to
+    roll wins when both players play optimally, and ROLLS[score][opponent_score]
+    is the number of dice that achieves it.
+
+    >>> win, rolls = solve()
+    >>> round(win[0][0], 4)
+    0.5026
+    >>> rolls[0][0], rolls[99][0]
+    (5, 0)
+    >>> round(win[99][0], 4)
+    1.0
+    >>> from hog import make_rules
+    >>> win, rolls = solve(make_rules(goal=50, free_bacon=False))
+    >>> round(win[0][0], 4), rolls[49][0]
+    (0.5048, 0)
+    """
+    _check_rules(rules)
+    goal, allowed = rules['goal'], rules['allowed']
+    win = [[0.0] * goal for _ in range(goal)]
+    rolls = [[0] * goal for _ in range(goal)]
+    # moved[o][s] is the chance that a player who just moved to score s wins
+    # when the opponent, at score o, rolls next.  Reaching the goal wins.
+    moved = [[1.0] * _row_size(rules) for _ in range(goal)]
+
+    # Every turn scores at least 1 point, so a state only depends on states
+    # whose scores sum to more.  Solve in order of decreasing sums.
+    for total in range(2 * goal - 2, -1, -1):
+        for score in range(max(0, total - goal + 1), min(total, goal - 1) + 1):
+            opponent_score = total - score
+            after = moved[opponent_score]
+            best, best_n = _chance(score, opponent_score, 0, after, rules), 0
+            for n in range(1, allowed[score][opponent_score] + 1):
+                chance = _chance(score, opponent_score, n, after, rules)
+                if chance > best + tolerance:
+                    best, best_n = chance, n
+            win[score][opponent_score] = best
+            rolls[score][opponent_score] = best_n
+            moved[score][opponent_score] = 1 - best
+    return win, rolls
+
+_solutions = {}
+
+def optimal_solution(rules=standard_rules):
+    """Return the memoized result of solve(RULES)."""
+    if rules['params'] not in _solutions:
+        _solutions[rules['params']] = solve(rules)
+    return _solutions[rules['params']]
+
+def optimal_strategy(score, opponent_score):
+    """A strategy that rolls the number of dice that maximizes the chance of
+    winning against an optimal opponent.
+
+    >>> optimal_strategy(0, 0)
+    5
+    """
+    return optimal_solution()[1][score][opponent_score]
+
+def optimal_win_rate(score, opponent_score):
+    """Return the chance that the player about to roll wins under optimal
+    play by both players.
+    """
+    return optimal_solution()[0][score][opponent_score]
+
+
+# Fixed strategies
+
+def _roll_choices(strategy, rules):
+    """Return the roll table of STRATEGY, a strategy function, a compiled
+    strategy, or a nested sequence of roll counts.
+    """
+    if callable(strategy):
+        return compile_strategy(strategy, rules).table
+    return [list(row) for row in strategy]
+
+def exact_win_rates(strategy0, strategy1, rules=standard_rules):
+    """Return the exact chances that player 0, who plays STRATEGY0 and goes
+    first, and player 1, who plays STRATEGY1, win a game.
+
+    >>> from hog import always_roll
+    >>> [round(p, 4) for p in exact_win_rates(always_roll(5), always_roll(5))]
+    [0.5026, 0.4974]
+    >>> rate = exact_win_rates(optimal_strategy, optimal_strategy)[0]
+    >>> rate == optimal_win_rate(0, 0)
+    True
+    """
+    _check_rules(rules)
+    goal, allowed = rules['goal'], rules['allowed']
+    tables = [_roll_choices(strategy0, rules), _roll_choices(strategy1, rules)]
+    # moved[w][o][s] is the chance that player w, who just moved to score s,
+    # wins when the other player, at score o, rolls next.
+    moved = [[[1.0] * _row_size(rules) for _ in range(goal)]
+             for _ in range(2)]
+    for total in range(2 * goal - 2, -1, -1):
+        for score in range(max(0, total - goal + 1), min(total, goal - 1) + 1):
+            opponent_score = total - score
+            most = allowed[score][opponent_score]
+            for who in (0, 1):
+                num_rolls = min(tables[who][score][opponent_score], most)
+                after = moved[who][opponent_score]
+                chance = _chance(score, opponent_score, num_rolls, after, rules)
+                moved[1 - who][score][opponent_score] = 1 - chance
+    first = 1 - moved[1][0][0]
+    return first, 1 - first
+
+def exact_compare(strategy, baseline, rules=standard_rules):
+    """Return the exact win rate of STRATEGY against BASELINE, averaged over
+    both seats like hog.compare_strategies.
+
+    >>> from hog import always_roll
+    >>> round(exact_compare(optimal_strategy, always_roll(5)), 4)
+    0.6369
+    """
+    as_first = exact_win_rates(strategy, baseline, rules)[0]
+    as_second = exact_win_rates(baseline, strategy, rules)[1]
+    return (as_first + as_second) / 2
@@ -0,0 +1,108 @@
+"""Round-robin tournaments between Hog strategies.
+
+Every pair of strategies in a pool plays a matchup, and the win rates are
+summarized as Elo-style ratings.  Matchups are cached on disk by the hashes
+of the two compiled roll tables, so adding one strategy to a pool of N only
+evaluates its N new matchups.
+"""
+
+from multiprocessing import get_context
+
+from cache import cache_path, load_results, save_results, table_hash
+from hog import can_fork, compile_strategy
+from solver import exact_compare
+
+def run_tournament(strategies, path=None, workers=None, evaluate=exact_compare):
+    """Return the win rates and ratings of a pool of STRATEGIES, a dictionary
+    from names to strategies.
+
+    The win rates are a dictionary in which rates[a][b] is the win rate of
+    strategy a against strategy b, averaged over both seats, as computed by
+    EVALUATE.  The ratings are a dictionary from names to Elo ratings.
+
+    path -- cache file of matchups; tournament_cache.json by default.
+    workers -- number of processes that evaluate new matchups, if
+               processes can be forked (see hog.can_fork).
+    evaluate -- a function of two roll tables that returns a win rate.
+
+    >>> import os, tempfile
+    >>> from hog import always_roll
+    >>> path = os.path.join(tempfile.mkdtemp(), 'matchups.json')
+    >>> pool = {'four': always_roll(4), 'five': always_roll(5)}
+    >>> rates, ratings = run_tournament(pool, path)
+    >>> round(rates['four']['five'], 4), round(rates['five']['four'], 4)
+    (0.4688, 0.5312)
+    >>> pool['six'] = always_roll(6)
+    >>> rates, ratings = run_tournament(pool, path)
+    >>> len(load_results(path)), sorted(ratings, key=ratings.get)
+    (3, ['four', 'six', 'five'])
+    """
+    path = path or cache_path('tournament')
+    tables = {name: compile_strategy(s).table for name, s in strategies.items()}
+    hashes = {name: table_hash(table) for name, table in tables.items()}
+    results = load_results(path)
+
+    def key(a, b):
+        return ':'.join([evaluate.__name__, hashes[a], hashes[b]])
+
+    names = sorted(strategies)
+    pairs = [(a, b) for i, a in enumerate(names) for b in names[i+1:]]
+    new_pairs = [(a, b) for a, b in pairs if key(a, b) not in results]
+    matchups = [(evaluate, tables[a], tables[b]) for a, b in new_pairs]
+    if workers is None or workers <= 1 or not can_fork:
+        new_rates = [_play_matchup(m) for m in matchups]
+    else:
+        with get_context('fork').Pool(workers) as pool:
+            new_rates = pool.map(_play_matchup, matchups)
+    if new_pairs:
+        for pair, rate in zip(new_pairs, new_rates):
+            results[key(*pair)] = rate
+        save_results(path, results)
+
+    rates = {name: {} for name in names}
+    for a, b in pairs:
+        rates[a][b] = results[key(a, b)]
+        rates[b][a] = 1 - rates[a][b]
+    return rates, elo_ratings(rates)
+
+def _play_matchup(matchup):
+    """Return the win rate of one table against another, where MATCHUP is an
+    (evaluate, table, other_table) triple.
+    """
+    evaluate, table, other_table = matchup
+    return evaluate(table, other_table)
+
+def elo_ratings(rates, rounds=1000, k=32, start=1500):
+    """Return a dictionary of Elo ratings that fit the win RATES of a
+    tournament, found by repeatedly moving each rating by K times the gap
+    between its actual and expected scores.  Ratings average to START.
+
+    >>> ratings = elo_ratings({'a': {'b': 0.64}, 'b': {'a': 0.36}})
+    >>> round(ratings['a'] - ratings['b'])
+    100
+    """
+    ratings = {name: start for name in rates}
+    for _ in range(rounds):
+        for name, row in rates.items():
+            gap = sum(rate - expected_score(ratings[name], ratings[other])
+                      for other, rate in row.items())
+            ratings[name] += k * gap / max(len(row), 1)
+        shift = start - sum(ratings.values()) / len(ratings)
+        ratings = {name: r + shift for name, r in ratings.items()}
+    return ratings
+
+def expected_score(rating, other_rating):
+    """Return the expected score of a player rated RATING against a player
+    rated OTHER_RATING.
+
+    >>> expected_score(1600, 1600)
+    0.5
+    """
+    return 1 / (1 + 10 ** ((other_rating - rating) / 400))
+
+def print_tournament(rates, ratings):
+    """Print the ratings of a tournament and each player's win rates."""
+    for name in sorted(ratings, key=ratings.get, reverse=True):
+        print('{0:>20}: {1:7.1f}'.format(name, ratings[name]))
+        for other in sorted(rates[name]):
+            print('{0:>28} {1:.4f}'.format(other, rates[name][other]))
@@ -0,0 +1,131 @@
+"""Compact binary traces of Hog games, and statistics computed from them.
+
+A trace file is a sequence of fixed-width records, one per turn:
+
+    game            4 bytes   Index of the game in the trace
+    player          1 byte    0 or 1
+    score           1 byte    Score of the player before the turn
+    opponent_score  1 byte    Score of the opponent
+    num_rolls       1 byte    Number of dice rolled, 0 for free bacon
+    sides           1 byte    Sides on the dice, or 0 if unknown
+    turn_score      1 byte    Points scored this turn
+
+Traces are written by a recorder that observes hog.play, and read back as
+memory-mapped NumPy arrays, so statistics over millions of games never
+re-run the simulation or load the whole file at once.
+"""
+
+import os
+from struct import Struct
+
+import numpy as np
+
+from hog import add_observer, play, remove_observer
+
+record_format = Struct('<IBBBBBB')
+record_dtype = np.dtype([('game', '<u4'), ('player', 'u1'), ('score', 'u1'),
+                         ('opponent_score', 'u1'), ('num_rolls', 'u1'),
+                         ('sides', 'u1'), ('turn_score', 'u1')])
+assert record_dtype.itemsize == record_format.size
+
+def make_recorder(path, buffer_size=4096):
+    """Return an observer (see hog.add_observer) that appends each turn to
+    the trace file at PATH, flushing every BUFFER_SIZE turns, and a function
+    to call after the last game that flushes and closes the file.
+    """
+    game = 0
+    if os.path.exists(path) and os.path.getsize(path):
+        game = _last_game(path) + 1
+    out = open(path, 'ab')
+    buffer = bytearray()
+    pending = 0
+
+    def turn_end(who, score, opponent_score, num_rolls, dice, turn_score):
+        nonlocal pending
+        sides = getattr(dice, 'sides', 0)
+        buffer.extend(record_format.pack(game, who, score, opponent_score,
+                                         num_rolls, sides, turn_score))
+        pending += 1
+        if pending == buffer_size:
+            flush()
+
+    def game_end(winner, score0, score1):
+        nonlocal game
+        game += 1
+
+    def flush():
+        nonlocal pending
+        out.write(buffer)
+        out.flush()
+        buffer.clear()
+        pending = 0
+
+    def close():
+        flush()
+        out.close()
+
+    return {'turn_end': turn_end, 'game_end': game_end}, close
+
+def _last_game(path):
+    """Return the index of the last game in the trace at PATH."""
+    return int(load_trace(path)['game'][-1])
+
+def record_games(strategy0, strategy1, num_games, path):
+    """Play NUM_GAMES games between STRATEGY0 and STRATEGY1, appending their
+    turns to the trace at PATH, and return the list of winners.
+    """
+    recorder, close = make_recorder(path)
+    add_observer(recorder)
+    try:
+        return [play(strategy0, strategy1) for _ in range(num_games)]
+    finally:
+        remove_observer(recorder)
+        close()
+
+def load_trace(path):
+    """Return the records of the trace at PATH as a read-only memory-mapped
+    structured array.
+    """
+    return np.memmap(path, dtype=record_dtype, mode='r')
+
+
+# Analysis
+
+def game_lengths(trace):
+    """Return an array whose element k is the number of games in TRACE that
+    lasted k turns.
+
+    >>> import os, tempfile
+    >>> from hog import always_roll
+    >>> path = os.path.join(tempfile.mkdtemp(), 'games.trace')
+    >>> winners = record_games(always_roll(0), always_roll(0), 3, path)
+    >>> trace = load_trace(path)
+    >>> len(trace), int(trace['turn_score'][:4].sum())
+    (174, 4)
+    >>> int(game_lengths(trace).argmax()), summarize(trace)['games']
+    (58, 3)
+    """
+    turns = np.bincount(trace['game'])
+    return np.bincount(turns[turns > 0])
+
+def winners(trace):
+    """Return the player who took the last turn of each game in TRACE."""
+    last = np.flatnonzero(np.diff(trace['game'].astype(np.int64)))
+    return trace['player'][np.append(last, len(trace) - 1)]
+
+def summarize(trace):
+    """Return a dictionary of statistics about the games in TRACE."""
+    turns = len(trace)
+    num_rolls = trace['num_rolls']
+    rolled = num_rolls > 0
+    pig_outs = rolled & (trace['turn_score'] == 1)
+    games = len(np.unique(trace['game']))
+    return {
+        'games': games,
+        'turns': turns,
+        'average_length': turns / games,
+        'free_bacon_rate': float(np.mean(~rolled)),
+        'four_sided_rate': float(np.mean(trace['sides'] == 4)),
+        'pig_out_rate': float(pig_outs.sum() / max(rolled.sum(), 1)),
+        'first_player_win_rate': float(np.mean(winners(trace) == 0)),
+    }
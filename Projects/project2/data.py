@@ -5,6 +5,8 @@ import re
 import string
 import sys
 from datetime import datetime
+from itertools import chain
+from struct import Struct
 from ucb import main, interact
 
 # Look for data directory
@@ -49,6 +51,310 @@ def generate_filtered_file(unfiltered_name, term):
                     out.write(line)
     return filtered_path
 
+
+# Inverted index of tweet files
+
+# An index file is a sequence of segments, one per indexing pass, that each
+# cover the lines from a start byte to an end byte of the tweet file.  A
+# segment is a header, a table of the words in those lines, and then the
+# byte offsets of the lines that contain each word, in table order.  Offsets
+# are stored as the gaps between them, in 7 bits per byte (the high bit
+# marks bytes that are followed by more of the same gap), so that the gaps
+# of common words, which are short, mostly take one byte.
+#
+# The location, weekday and time at the start of a tweet line hold no words
+# but numbers, which are nearly all different, so only the text after them
+# is indexed.
+segment_header = Struct('<4sQQII')  # Magic, start, end, words, table bytes
+word_header = Struct('<HII')        # Word length, lines, bytes of gaps
+segment_magic = b'TWI3'
+index_suffix = '.idx'
+line_metadata = re.compile(r'\[[-\d., ]*\]\t\d*\t[-\d: ]*\t')
+
+def line_words(line):
+    """Return the set of words in LINE, ignoring case.
+
+    >>> sorted(line_words('Obama: "My job" is #jobs!'))
+    ['is', 'job', 'jobs', 'my', 'obama']
+    """
+    return set(re.findall(r'\w+', line.lower()))
+
+def indexed_words(line):
+    """Return the set of words in the text of the tweet LINE, or in all of
+    LINE if it does not start with a location, weekday and time.
+
+    >>> sorted(indexed_words('[38.5, -121.4]\\t6\\t2011-08-28 19:04:06\\tParty at 8'))
+    ['8', 'at', 'party']
+    """
+    metadata = line_metadata.match(line)
+    return line_words(line[metadata.end():] if metadata else line)
+
+def update_index(corpus_path):
+    """Add the lines appended to the tweet file at CORPUS_PATH since it was
+    last indexed to its index file, and return the path of the index file.
+
+    Only complete lines are indexed, and the whole file is indexed again if
+    it is shorter than the part already indexed.  A segment left incomplete
+    by an interrupted update, or in an older format, is removed, and its
+    lines are indexed again.
+
+    >>> import os, tempfile
+    >>> corpus = os.path.join(tempfile.mkdtemp(), 'tweets.txt')
+    >>> with open(corpus, 'w', encoding='utf8') as f:
+    ...     n = f.write('[1, 2]\\t_\\t2011-08-28 18:47:46\\tlove my job\\n')
+    >>> path = update_index(corpus)
+    >>> size = os.path.getsize(path)
+    >>> with open(corpus, 'a', encoding='utf8') as f:
+    ...     n = f.write('[3, 4]\\t_\\t2011-08-28 18:48:00\\tmy job again\\n')
+    >>> with open(path, 'ab') as f:  # An update interrupted mid-segment
+    ...     n = f.write(segment_magic + bytes(10))
+    >>> os.path.getsize(update_index(corpus)) > size
+    True
+    >>> len(list(matching_lines(corpus, 'my job')))
+    2
+    """
+    path = corpus_path + index_suffix
+    end = 0
+    if os.path.exists(path):
+        end, _, complete = _read_index(path)
+        if complete < os.path.getsize(path):
+            os.truncate(path, complete)  # Drop an interrupted segment
+    size = os.path.getsize(corpus_path)
+    if size < end:
+        os.remove(path)
+        end = 0
+    if size == end:
+        return path
+    postings = {}
+    offset = end
+    with open(corpus_path, 'rb') as corpus:
+        corpus.seek(end)
+        for line in corpus:
+            if not line.endswith(b'\n'):
+                break
+            for word in indexed_words(line.decode('utf8', 'replace')):
+                postings.setdefault(word, []).append(offset)
+            offset += len(line)
+    if offset > end:
+        with open(path, 'ab') as out:
+            out.write(_encode_segment(end, offset, postings))
+    return path
+
+def _encode_segment(start, end, postings):
+    """Return the bytes of an index segment for lines from START to END,
+    where POSTINGS is a dictionary from words to increasing line offsets.
+    """
+    table, blocks = bytearray(), []
+    for word in sorted(postings):
+        encoded, offsets = word.encode('utf8'), postings[word]
+        gaps = [offsets[0] - start]
+        gaps.extend(b - a for a, b in zip(offsets, offsets[1:]))
+        block = _encode_gaps(gaps)
+        table += word_header.pack(len(encoded), len(offsets), len(block))
+        table += encoded
+        blocks.append(block)
+    header = segment_header.pack(segment_magic, start, end, len(postings),
+                                 len(table))
+    return header + table + b''.join(blocks)
+
+def _encode_gaps(gaps):
+    """Return the bytes of a list of GAPS, 7 bits per byte.
+
+    >>> list(_encode_gaps([5, 300]))
+    [5, 172, 2]
+    >>> list(_decode_gaps([_encode_gaps([5, 300, 0, 2**40])]))
+    [5, 300, 0, 1099511627776]
+    """
+    encoded = bytearray()
+    for gap in gaps:
+        while gap >= 128:
+            encoded.append(gap & 127 | 128)
+            gap >>= 7
+        encoded.append(gap)
+    return bytes(encoded)
+
+def _decode_gaps(blocks):
+    """Yield the gaps in the iterable of byte strings BLOCKS that together
+    hold the output of _encode_gaps.
+    """
+    gap, shift = 0, 0
+    for block in blocks:
+        for byte in block:
+            gap |= (byte & 127) << shift
+            if byte & 128:
+                shift += 7
+            else:
+                yield gap
+                gap, shift = 0, 0
+
+_indexes = {}
+
+def _read_index(path):
+    """Return the end of the part of the tweet file covered by the index at
+    PATH, a dictionary from words to lists of (start, position, size)
+    triples, and the size of the complete segments of the index.  For each
+    segment that has a word, its triple holds the start of the segment, and
+    the position and size of the gaps between its lines in the file.
+
+    A segment cut short by an interrupted update_index, or written in an
+    older format, is ignored along with the rest of the file.
+    """
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    if key in _indexes:
+        return _indexes[key]
+    words, end, complete = {}, 0, 0
+    with open(path, 'rb') as f:
+        header = f.read(segment_header.size)
+        while len(header) == segment_header.size:
+            magic, start, segment_end, num_words, table_size = \
+                segment_header.unpack(header)
+            table = f.read(table_size)
+            if magic != segment_magic or len(table) < table_size:
+                break
+            position, cursor, entries = f.tell(), 0, []
+            for _ in range(num_words):
+                length, _, size = word_header.unpack_from(table, cursor)
+                cursor += word_header.size
+                word = table[cursor:cursor + length].decode('utf8')
+                cursor += length
+                entries.append((word, (start, position, size)))
+                position += size
+            if position > stat.st_size:
+                break
+            for word, entry in entries:
+                words.setdefault(word, []).append(entry)
+            end, complete = segment_end, position
+            f.seek(position)
+            header = f.read(segment_header.size)
+    _indexes.clear()
+    _indexes[key] = (end, words, complete)
+    return end, words, complete
+
+def _line_offsets(index_path, entries, block_size=65536):
+    """Yield the line offsets in the index segment ENTRIES of a word, in
+    increasing order, reading the index at INDEX_PATH BLOCK_SIZE bytes at a
+    time.
+    """
+    if not entries:
+        return
+    with open(index_path, 'rb') as index_file:
+        for start, position, size in entries:
+            blocks = _read_blocks(index_file, position, size, block_size)
+            for gap in _decode_gaps(blocks):
+                start += gap
+                yield start
+
+def _read_blocks(f, position, size, block_size):
+    """Yield the SIZE bytes at POSITION in the open file F, in blocks of at
+    most BLOCK_SIZE bytes.
+    """
+    f.seek(position)
+    while size > 0:
+        block = f.read(min(block_size, size))
+        if not block:
+            return
+        yield block
+        size -= len(block)
+
+def _intersect(offsets):
+    """Yield the numbers in every one of the iterators OFFSETS, each of
+    which yields increasing numbers.
+
+    >>> list(_intersect([iter([1, 3, 5, 7]), iter([2, 3, 7, 8]), iter([3, 7])]))
+    [3, 7]
+    """
+    try:
+        values = [next(o) for o in offsets]
+        while True:
+            high = max(values)
+            for i, o in enumerate(offsets):
+                while values[i] < high:
+                    values[i] = next(o)
+            if values.count(high) == len(values):
+                yield high
+                values = [next(o) for o in offsets]
+    except StopIteration:
+        return
+
+def matching_lines(corpus_path, term):
+    """Yield the lines of the tweet file at CORPUS_PATH that contain TERM as
+    generate_filtered_file would select them, in order.
+
+    The index of the file is updated first, and then only the lines that
+    contain every word of TERM that is not a number are read and checked.  The line offsets of
+    each word are decoded as they are needed, so memory use does not grow
+    with the number of lines that match.
+
+    >>> import os, tempfile
+    >>> corpus = os.path.join(tempfile.mkdtemp(), 'tweets.txt')
+    >>> with open(corpus, 'w', encoding='utf8') as f:
+    ...     n = f.write('[1, 2]\\t_\\t2011-08-28 18:47:46\\tlove my job\\n'
+    ...                 '[3, 4]\\t_\\t2011-08-28 18:48:00\\tno jobs here\\n')
+    >>> [line.split('\\t')[-1] for line in matching_lines(corpus, 'my job')]
+    ['love my job\\n']
+    >>> with open(corpus, 'a', encoding='utf8') as f:
+    ...     n = f.write('[5, 6]\\t_\\t2011-08-28 19:00:00\\tMY JOB again\\n')
+    >>> len(list(matching_lines(corpus, 'my job')))
+    2
+    >>> with open(corpus, 'a', encoding='utf8') as f:
+    ...     n = f.write('[7, 8]\\t_\\t2011-08-28 19:30:00\\tmy job, no newline')
+    >>> len(list(matching_lines(corpus, 'my job')))
+    3
+    """
+    # Numbers may be in the location or time, which are not indexed
+    words = [w for w in line_words(term) if not w.isdigit()]
+    r = re.compile('\\W' + term + '\\W', flags=re.IGNORECASE)
+    path = update_index(corpus_path)
+    end, index = _read_index(path)[:2] if os.path.exists(path) else (0, {})
+    with open(corpus_path, 'rb') as corpus:
+        if words:
+            postings = [index.get(w, []) for w in words]
+            offsets = _intersect([_line_offsets(path, entries)
+                                  for entries in postings])
+            # A last line without a newline is not indexed
+            offsets = chain(offsets, _all_line_offsets(corpus_path, end))
+        else:  # A term without other words could be anywhere
+            offsets = _all_line_offsets(corpus_path)
+        for offset in offsets:
+            corpus.seek(offset)
+            line = corpus.readline().decode('utf8')
+            if term in line.lower() and r.search(line):
+                yield line
+
+def _all_line_offsets(corpus_path, start=0):
+    """Yield the offsets of every line from START in the tweet file at
+    CORPUS_PATH.
+    """
+    offset = start
+    with open(corpus_path, 'rb') as corpus:
+        corpus.seek(start)
+        for line in corpus:
+            yield offset
+            offset += len(line)
+
+def _filtered_lines(filtered_path):
+    """Yield the lines of the filtered file at FILTERED_PATH."""
+    with open(filtered_path, encoding='utf8') as lines:
+        yield from lines
+
+def iter_tweets(make_tweet, term='my job', file_name='all_tweets.txt'):
+    """Yield the tweets in file_name that contain term, one at a time, in the
+    order of load_tweets, without holding them all in memory.
+    """
+    term = term.lower()
+    corpus_path = os.path.join(DATA_PATH, file_name)
+    if os.path.exists(corpus_path):
+        lines = matching_lines(corpus_path, term)
+    else:
+        lines = _filtered_lines(DATA_PATH + file_name_for_term(term))
+    for line in lines:
+        if len(line.strip().split("\t")) >=4:
+            loc, _, time_text, text = line.strip().split("\t")
+            time = datetime.strptime(time_text, '%Y-%m-%d %H:%M:%S')
+            lat, lon = eval(loc)
+            yield make_tweet(text.lower(), time, lat, lon)
+
 def load_tweets(make_tweet, term='my job', file_name='all_tweets.txt'):
     """Return the list of tweets in file_name that contain term.
 
@@ -57,15 +363,10 @@ def load_tweets(make_tweet, term='my job', file_name='all_tweets.txt'):
       - a datetime.datetime object representing the time of the tweet
       - a longitude coordinate
       - a latitude coordinate
+
+    Tweets are found with the inverted index of file_name (see
+    matching_lines).  Without file_name, a filtered file made earlier by
+    generate_filtered_file is read instead.  See iter_tweets to read the
+    tweets one at a time.
     """
-    term = term.lower()
-    filtered_path = generate_filtered_file(file_name, term)
-    tweets = []
-    for line in open(filtered_path, encoding='utf8'):
-        if len(line.strip().split("\t")) >=4:
-            loc, _, time_text, text = line.strip().split("\t")
-            time = datetime.strptime(time_text, '%Y-%m-%d %H:%M:%S')
-            lat, lon = eval(loc)
-            tweet = make_tweet(text.lower(), time, lat, lon)
-            tweets.append(tweet)
-    return tweets
+    return list(iter_tweets(make_tweet, term, file_name))
@@ -1,7 +1,7 @@
 """Geography and projection utilities."""
 
 from data import DATA_PATH
-from math import sin, cos, atan2, radians, sqrt
+from math import sin, cos, atan2, radians, sqrt, inf
 from json import JSONDecoder
 
 def make_position(lat, lon):
@@ -34,6 +34,273 @@ def geo_distance(position1, position2):
     c = 2 * atan2(sqrt(a), sqrt(1-a));
     return earth_radius * c;
 
+def geo_distance_matrix(positions, references):
+    """Return an array of the great circle distances (in miles) from each of
+    POSITIONS to each of REFERENCES, in which element [i, j] is
+    geo_distance(positions[i], references[j]).
+
+    POSITIONS and REFERENCES are sequences of geographic positions, or
+    arrays with a latitude and a longitude in each row.  NumPy computes all
+    of the distances at once.
+
+    >>> positions = [make_position(50, 5), make_position(38, -122)]
+    >>> references = [make_position(58, 3), make_position(41, -74)]
+    >>> distances = geo_distance_matrix(positions, references)
+    >>> all(abs(distances[i, j] - geo_distance(p, r)) < 1e-9
+    ...     for i, p in enumerate(positions) for j, r in enumerate(references))
+    True
+    """
+    import numpy as np
+    a = _haversines(positions, references)
+    return 3963.2 * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+def closest_positions(positions, references, chunk_size=65536):
+    """Return an array of the index of the closest of REFERENCES to each of
+    POSITIONS, as in geo_distance_matrix, taking the first on ties.
+    POSITIONS are handled CHUNK_SIZE at a time, to bound memory use.
+
+    >>> references = [make_position(58, 3), make_position(41, -74)]
+    >>> closest_positions([make_position(50, 5), make_position(38, -122)],
+    ...                   references).tolist()
+    [0, 1]
+    """
+    import numpy as np
+    positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+    closest = np.empty(len(positions), dtype=np.int64)
+    for start in range(0, len(positions), chunk_size):
+        chunk = positions[start:start + chunk_size]
+        # Distances increase with the haversines, so compare those directly.
+        haversines = _haversines(chunk, references)
+        closest[start:start + chunk_size] = haversines.argmin(axis=1)
+    return closest
+
+def _haversines(positions, references):
+    """Return the matrix of the haversines of the central angles between
+    POSITIONS and REFERENCES, the value A in geo_distance.
+    """
+    import numpy as np
+    positions = np.radians(np.asarray(positions, dtype=float).reshape(-1, 2))
+    references = np.radians(np.asarray(references, dtype=float).reshape(-1, 2))
+    # Expand the sines of half differences, so that trigonometry is only
+    # needed once per position rather than once per pair.
+    sin1, cos1 = np.sin(positions / 2), np.cos(positions / 2)
+    sin2, cos2 = np.sin(references / 2), np.cos(references / 2)
+    def sin_half_squared(axis):  # sin((p2 - p1) / 2) ** 2 along an axis
+        s = np.multiply.outer(cos1[:, axis], sin2[:, axis])
+        s -= np.multiply.outer(sin1[:, axis], cos2[:, axis])
+        s *= s
+        return s
+    a = sin_half_squared(1)
+    a *= np.multiply.outer(np.cos(positions[:, 0]), np.cos(references[:, 0]))
+    a += sin_half_squared(0)
+    return np.minimum(a, 1, out=a)
+
+def position_to_vector(position):
+    """Return the point on the unit sphere at a geographic position, as an
+    (x, y, z) tuple.  Straight-line distances between these points increase
+    with geo_distance between the positions.
+    """
+    lat, lon = radians(latitude(position)), radians(longitude(position))
+    return (cos(lat) * cos(lon), cos(lat) * sin(lon), sin(lat))
+
+def make_nearest_index(named_positions):
+    """Return a function that takes a position and returns the name of the
+    position in NAMED_POSITIONS, a dictionary from names to positions, with
+    the smallest geo_distance to it.  Ties go to the name that comes first
+    in NAMED_POSITIONS.
+
+    The positions are stored in a k-d tree of points on the unit sphere (see
+    position_to_vector), so a search visits about log(n) of the n positions.
+
+    >>> nearest = make_nearest_index({'SF': make_position(37.8, -122.4),
+    ...                               'NY': make_position(40.7, -74.0),
+    ...                               'MIA': make_position(25.8, -80.2)})
+    >>> nearest(make_position(34, -118)), nearest(make_position(30, -85))
+    ('SF', 'MIA')
+    """
+    points = [(position_to_vector(position), order, name) for order, (name,
+              position) in enumerate(named_positions.items())]
+    tree = _build_tree(points, 0)
+
+    def nearest(position):
+        best = [inf, 0, None]  # Squared distance, order and name of the best
+        _search_tree(tree, position_to_vector(position), best)
+        return best[2]
+    return nearest
+
+def _build_tree(points, depth):
+    """Return a k-d tree of POINTS, a list of (vector, order, name) triples,
+    that splits on coordinate DEPTH % 3 at its root.
+
+    A tree is None or a (point, axis, left, right) tuple, where every vector
+    in LEFT has a coordinate AXIS no larger than that of POINT, and every
+    vector in RIGHT has one no smaller.
+    """
+    if not points:
+        return None
+    axis = depth % 3
+    points = sorted(points, key=lambda point: point[0][axis])
+    middle = len(points) // 2
+    return (points[middle], axis, _build_tree(points[:middle], depth + 1),
+            _build_tree(points[middle + 1:], depth + 1))
+
+def _search_tree(tree, target, best):
+    """Update BEST, a [squared distance, order, name] list, with any point in
+    TREE closer to the TARGET vector, skipping subtrees that cannot hold one.
+    """
+    if tree is None:
+        return
+    (vector, order, name), axis, left, right = tree
+    distance = ((target[0] - vector[0]) ** 2 + (target[1] - vector[1]) ** 2 +
+                (target[2] - vector[2]) ** 2)
+    if distance < best[0] or (distance == best[0] and order < best[1]):
+        best[0], best[1], best[2] = distance, order, name
+    gap = target[axis] - vector[axis]
+    near, far = (left, right) if gap < 0 else (right, left)
+    _search_tree(near, target, best)
+    if gap * gap <= best[0]:
+        _search_tree(far, target, best)
+
+def point_in_polygon(position, polygon):
+    """Return whether a geographic position is inside POLYGON, a list of
+    positions, treating latitude and longitude as planar coordinates.
+
+    A ray from the position crosses the edges of the polygon an odd number
+    of times exactly when the position is inside.
+
+    >>> square = [make_position(0, 0), make_position(0, 2),
+    ...           make_position(2, 2), make_position(2, 0)]
+    >>> point_in_polygon(make_position(1, 1), square)
+    True
+    >>> point_in_polygon(make_position(1, 3), square)
+    False
+    """
+    lat, lon = latitude(position), longitude(position)
+    inside = False
+    lat1, lon1 = polygon[-1]
+    for lat2, lon2 in polygon:
+        if (lat1 > lat) != (lat2 > lat):
+            if lon < (lon2 - lon1) * (lat - lat1) / (lat2 - lat1) + lon1:
+                inside = not inside
+        lat1, lon1 = lat2, lon2
+    return inside
+
+def make_polygon_index(named_shapes, node_size=8):
+    """Return an R-tree of the bounding boxes of the polygons in
+    NAMED_SHAPES, a dictionary from names to lists of polygons like
+    us_states, with at most NODE_SIZE children per node.
+
+    A box is a (min_lat, min_lon, max_lat, max_lon) tuple.  A node of the
+    tree is a (box, children, entry) tuple: a leaf has no children and a
+    (name, polygon) entry, and any other node has None as its entry.  Nodes
+    are packed by sorting their boxes into tiles (Sort-Tile-Recursive), so
+    boxes near each other share parents.
+
+    >>> tree = make_polygon_index(us_states)
+    >>> tree[0][0] < 20 and tree[0][1] < -170
+    True
+    """
+    nodes = [(_polygon_box(polygon), (), (name, polygon))
+             for name, shapes in named_shapes.items() for polygon in shapes]
+    while len(nodes) > 1:
+        nodes = [(_union_box(group), group, None)
+                 for group in _tile(nodes, node_size)]
+    return nodes[0]
+
+def _polygon_box(polygon):
+    """Return the bounding box of POLYGON."""
+    lats, lons = [latitude(p) for p in polygon], [longitude(p) for p in polygon]
+    return (min(lats), min(lons), max(lats), max(lons))
+
+def _union_box(nodes):
+    """Return the bounding box of the boxes of NODES."""
+    boxes = [node[0] for node in nodes]
+    return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+            max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+def _tile(nodes, node_size):
+    """Return NODES split into groups of at most NODE_SIZE, in vertical
+    slices by longitude that are each sorted by latitude.
+    """
+    def center(node, axis):
+        return node[0][axis] + node[0][axis + 2]
+    num_groups = -(-len(nodes) // node_size)
+    slice_size = node_size * max(int(sqrt(num_groups)), 1)
+    nodes = sorted(nodes, key=lambda node: center(node, 1))
+    groups = []
+    for start in range(0, len(nodes), slice_size):
+        tile = sorted(nodes[start:start + slice_size],
+                      key=lambda node: center(node, 0))
+        groups.extend(tile[i:i + node_size]
+                      for i in range(0, len(tile), node_size))
+    return groups
+
+def containing_name(tree, position):
+    """Return the name of a polygon in the R-TREE that contains a geographic
+    position, or None if none do.  Only polygons whose boxes hold the
+    position are checked.
+
+    >>> tree = make_polygon_index(us_states)
+    >>> containing_name(tree, make_position(40.71, -74.01))  # Manhattan
+    'NY'
+    >>> containing_name(tree, make_position(30, -140)) is None
+    True
+    """
+    lat, lon = latitude(position), longitude(position)
+    box, children, entry = tree
+    if not (box[0] <= lat <= box[2] and box[1] <= lon <= box[3]):
+        return None
+    if entry is not None:
+        name, polygon = entry
+        return name if point_in_polygon(position, polygon) else None
+    for child in children:
+        name = containing_name(child, position)
+        if name is not None:
+            return name
+    return None
+
+def containing_names(tree, positions, chunk_size=4096):
+    """Return a list of containing_name(TREE, p) for each of POSITIONS.
+
+    All positions descend the R-tree together as NumPy arrays, and each
+    polygon checks the positions in its box CHUNK_SIZE at a time.
+
+    >>> tree = make_polygon_index(us_states)
+    >>> containing_names(tree, [make_position(40.71, -74.01),
+    ...                         make_position(30, -140)])
+    ['NY', None]
+    """
+    import numpy as np
+    positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+    found = [None] * len(positions)
+    pending = [(tree, np.arange(len(positions)))]
+    while pending:
+        (box, children, entry), indices = pending.pop()
+        lats, lons = positions[indices, 0], positions[indices, 1]
+        inside = ((lats >= box[0]) & (lats <= box[2]) &
+                  (lons >= box[1]) & (lons <= box[3]))
+        indices = indices[inside]
+        if not len(indices):
+            continue
+        if entry is None:
+            # Pushed in reverse, children are searched in order.
+            pending.extend((child, indices) for child in reversed(children))
+            continue
+        name, polygon = entry
+        edges = np.array(polygon, dtype=float)
+        lat1, lon1 = np.roll(edges, 1, axis=0).T
+        lat2, lon2 = edges.T
+        for start in range(0, len(indices), chunk_size):
+            chunk = indices[start:start + chunk_size]
+            lat, lon = positions[chunk, 0, None], positions[chunk, 1, None]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                cross = (lon2 - lon1) * (lat - lat1) / (lat2 - lat1) + lon1
+            crossings = ((lat1 > lat) != (lat2 > lat)) & (lon < cross)
+            for index in chunk[crossings.sum(axis=1) % 2 == 1]:
+                if found[index] is None:
+                    found[index] = name
+    return found
+
 def position_to_xy(position):
     """Convert a geographic position within the US to a planar x-y point."""
     lat = latitude(position)
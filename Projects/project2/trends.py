@@ -1,11 +1,16 @@
 """Visualizing Twitter Sentiment Across America"""
 
-from data import word_sentiments, load_tweets
+from data import word_sentiments, load_tweets, iter_tweets, DATA_PATH
 from datetime import datetime
 from doctest import run_docstring_examples, testmod
 from geo import us_states, geo_distance, make_position, longitude, latitude
+from geo import make_nearest_index, make_polygon_index, containing_names
 from maps import draw_state, draw_name, draw_dot, wait, message
 from string import ascii_letters
+from hashlib import sha1
+from itertools import islice
+from json import dump, load
+from os import path, replace
 from ucb import main, trace, interact, log_current_line
 
 #run_docstring_examples(extract_words, globals(), True)
@@ -349,6 +354,59 @@ def find_center(polygons):
     return make_position(gen_center_x, gen_center_y)
 
 
+# State geometry, computed once per states.json
+
+states_file = DATA_PATH + 'states.json'
+geometry_cache_file = DATA_PATH + 'state_geometry_cache.json'
+_state_geometry = None
+
+def state_geometry():
+    """Return a dictionary from state names to the centers of the states in
+    us_states, and a dictionary from state names to the areas of their
+    polygons.
+
+    Both are computed once, and stored in geometry_cache_file with a hash of
+    states_file, so later runs only compute them again if the shapes change.
+
+    >>> centers, areas = state_geometry()
+    >>> centers['CA'] == find_center(us_states['CA'])
+    True
+    >>> len(areas['HI'])  # Hawaii has 5 islands
+    5
+    >>> list(centers) == list(us_states)
+    True
+    """
+    global _state_geometry
+    if _state_geometry is None:
+        with open(states_file, 'rb') as f:
+            digest = sha1(f.read()).hexdigest()
+        cached = None
+        if path.exists(geometry_cache_file):
+            with open(geometry_cache_file, encoding='utf8') as f:
+                cached = load(f)
+        if cached is None or cached['hash'] != digest:
+            cached = {'hash': digest, 'centers': {}, 'areas': {}}
+            for name, shapes in us_states.items():
+                cached['centers'][name] = find_center(shapes)
+                cached['areas'][name] = [find_centroid(p)[2] for p in shapes]
+            partial = geometry_cache_file + '.partial'
+            with open(partial, 'w', encoding='utf8') as f:
+                dump(cached, f)
+            replace(partial, geometry_cache_file)
+        # Keep the order of us_states, which breaks ties between states
+        centers = {name: make_position(*cached['centers'][name])
+                   for name in us_states}
+        areas = {name: cached['areas'][name] for name in us_states}
+        _state_geometry = (centers, areas)
+    return _state_geometry
+
+def state_centers():
+    """Return a dictionary from state names to their centers (see
+    state_geometry), which callers must not change.
+    """
+    return state_geometry()[0]
+
+
 # Phase 3: The Mood of the Nation
 
 def find_closest_state(tweet, state_centers):
@@ -379,31 +437,83 @@ def find_closest_state(tweet, state_centers):
     'MO'
     """
     "*** YOUR CODE HERE ***"
-    pos1 = tweet_location(tweet) #first position
-    dist_list = {} #dictionary of distances
-    state = ""
-    for each_center in state_centers:  #iterates through centers of states
-        distance = geo_distance(pos1, state_centers[each_center])
-        dist_list[each_center] = distance  #orders distance of tweet with centers
-    for state_key in dist_list: #iterates through keys in distance dictionary
-        if distance > dist_list[state_key]:
-            distance = dist_list[state_key]
-            state = state_key
-    return state
+    position = tweet_location(tweet)
+    return min(state_centers,
+               key=lambda name: geo_distance(position, state_centers[name]))
+
+def find_closest_states(tweets, state_centers):
+    """Return a list of the names of the states closest to each of TWEETS,
+    searching one spatial index of STATE_CENTERS (see geo.make_nearest_index).
+
+    >>> us_centers = {n: find_center(s) for n, s in us_states.items()}
+    >>> tweets = [make_tweet("", None, lat, lon) for lat in range(18, 66, 3)
+    ...           for lon in range(-165, -65, 4)]
+    >>> def closest(tweet):
+    ...     position = tweet_location(tweet)
+    ...     return min(us_centers, key=lambda n: geo_distance(position, us_centers[n]))
+    >>> find_closest_states(tweets, us_centers) == [closest(t) for t in tweets]
+    True
+    """
+    nearest = state_index(state_centers)
+    return [nearest(tweet_location(tweet)) for tweet in tweets]
+
+def find_containing_states(tweets, state_centers):
+    """Return a list of the names of the states whose shapes in us_states
+    contain each of TWEETS, or of the closest states in STATE_CENTERS to
+    tweets outside every state.
+
+    Only the few polygons whose bounding boxes hold a tweet, found with an
+    R-tree (see geo.make_polygon_index), are checked for containment.
 
-def group_tweets_by_state(tweets):
+    >>> ny = make_tweet("Welcome to New York", None, 40.71, -74.01)
+    >>> sea = make_tweet("Out at sea", None, 35, -125)
+    >>> find_containing_states([ny, sea], state_centers())
+    ['NY', 'CA']
+    """
+    global _polygon_index
+    if _polygon_index is None:
+        _polygon_index = make_polygon_index(us_states)
+    locations = [tweet_location(tweet) for tweet in tweets]
+    names = containing_names(_polygon_index, locations)
+    nearest = state_index(state_centers)
+    return [name or nearest(location)
+            for name, location in zip(names, locations)]
+
+_polygon_index = None
+
+_state_index = ((), None)  # The items of the last state centers, and their index
+
+def state_index(state_centers):
+    """Return a function from positions to the names of the closest states in
+    STATE_CENTERS, reusing the index of the last state centers if their
+    states and positions are unchanged.
+    """
+    global _state_index
+    items = tuple(state_centers.items())
+    if _state_index[0] != items:
+        _state_index = (items, make_nearest_index(state_centers))
+    return _state_index[1]
+
+def group_tweets_by_state(tweets, by_shape=False):
     """Return a dictionary that aggregates tweets by their nearest state center.
 
     The keys of the returned dictionary are state names, and the values are
     lists of tweets that appear closer to that state center than any other.
 
     tweets -- a sequence of tweet abstract data types
+    by_shape -- whether to group tweets by the state whose shape contains
+                them instead, when there is one (see find_containing_states)
 
     >>> sf = make_tweet("Welcome to San Francisco", None, 38, -122)
     >>> ny = make_tweet("Welcome to New York", None, 41, -74)
     >>> ca_tweets = group_tweets_by_state([sf, ny])['CA']
     >>> tweet_string(ca_tweets[0])
     '"Welcome to San Francisco" @ (38, -122)'
+    >>> nyc = make_tweet("Welcome to New York", None, 40.71, -74.01)
+    >>> list(group_tweets_by_state([nyc]))
+    ['NJ']
+    >>> list(group_tweets_by_state([nyc], by_shape=True))
+    ['NY']
 
 
     #In tweets_by_state['MO'], if you put this doctest into your trends.py file, it should work correctly. If you just read it on Piazza, there'll be double-slashes (\\) on Piazza but not in the Python output. Don't worry about that.
@@ -417,9 +527,11 @@ def group_tweets_by_state(tweets):
     tweets_by_state = {}
     
     "*** YOUR CODE HERE ***"
-    us_centers = {n: find_center(s) for n, s in us_states.items()} #Lists states
-    for tweet in tweets: #In each tweet find the closest state to group by
-        location = find_closest_state(tweet,us_centers)
+    if by_shape:
+        locations = find_containing_states(tweets, state_centers())
+    else:
+        locations = find_closest_states(tweets, state_centers())
+    for tweet, location in zip(tweets, locations): #Group by closest state
         if location in tweets_by_state:
             tweets_by_state[location] += [tweet,]
         else:
@@ -539,6 +651,43 @@ def average_sentiments(tweets_by_state):
     return averaged_state_sentiments
 
 
+def stream_average_sentiments(tweets, by_shape=False, chunk_size=4096):
+    """Return average_sentiments(group_tweets_by_state(TWEETS, BY_SHAPE)) for
+    an iterable of TWEETS, such as one from iter_tweets.
+
+    Tweets are located CHUNK_SIZE at a time, and only a running total and
+    count of sentiment is kept for each state, so memory use does not grow
+    with the number of tweets.
+
+    >>> tweets = load_tweets(make_tweet, 'obama')
+    >>> expected = average_sentiments(group_tweets_by_state(tweets))
+    >>> stream_average_sentiments(iter_tweets(make_tweet, 'obama')) == expected
+    True
+    """
+    totals = _sentiment_totals(tweets, lambda tweet, state: state,
+                               by_shape, chunk_size)
+    return {state: total / count for state, (total, count) in totals.items()}
+
+def _sentiment_totals(tweets, key, by_shape, chunk_size):
+    """Return a dictionary from KEY(tweet, state) to the total and count of
+    the sentiments of TWEETS that have one, where state is the state of the
+    tweet found as group_tweets_by_state would.
+    """
+    find_states = find_containing_states if by_shape else find_closest_states
+    us_centers = state_centers()
+    totals = {}
+    tweets = iter(tweets)
+    chunk = list(islice(tweets, chunk_size))
+    while chunk:
+        for tweet, state in zip(chunk, find_states(chunk, us_centers)):
+            s = analyze_tweet_sentiment(tweet)
+            if has_sentiment(s):
+                k = key(tweet, state)
+                total, count = totals.get(k, (0, 0))
+                totals[k] = (total + sentiment_value(s), count + 1)
+        chunk = list(islice(tweets, chunk_size))
+    return totals
+
     
 # Phase 4: Into the Fourth Dimension
 
@@ -603,6 +752,28 @@ def group_tweets_by_hour(tweets):
             tweets_by_hour[hour] += [each_tweet,] #add another if already correlated
     return tweets_by_hour
 
+def stream_sentiments_by_hour(tweets, by_shape=False, chunk_size=4096):
+    """Return a dictionary from each hour to the average sentiments of the
+    states for the TWEETS posted in that hour, like stream_average_sentiments.
+    Hours in which no tweet has a sentiment are left out.
+
+    >>> tweets = load_tweets(make_tweet, 'party')
+    >>> by_hour = stream_sentiments_by_hour(iter_tweets(make_tweet, 'party'))
+    >>> by_hour[17]['CA']
+    0.09807900432900431
+    >>> tweets_by_hour = group_tweets_by_hour(tweets)
+    >>> all(by_hour.get(hour, {}) ==
+    ...     average_sentiments(group_tweets_by_state(tweets_by_hour[hour]))
+    ...     for hour in tweets_by_hour)
+    True
+    """
+    hour_and_state = lambda tweet, state: (tweet_time(tweet).hour, state)
+    totals = _sentiment_totals(tweets, hour_and_state, by_shape, chunk_size)
+    sentiments_by_hour = {}
+    for (hour, state), (total, count) in totals.items():
+        sentiments_by_hour.setdefault(hour, {})[state] = total / count
+    return sentiments_by_hour
+
 
 # Interaction.  You don't need to read this section of the program.
 
@@ -618,7 +789,7 @@ def print_sentiment(text='Are you virtuous or verminous?'):
 
 def draw_centered_map(center_state='TX', n=10):
     """Draw the n states closest to center_state."""
-    us_centers = {n: find_center(s) for n, s in us_states.items()}
+    us_centers = state_centers()
     center = us_centers[center_state.upper()]
     dist_from_center = lambda name: geo_distance(center, us_centers[name])
     for name in sorted(us_states.keys(), key=dist_from_center)[:int(n)]:
@@ -637,8 +808,7 @@ def draw_state_sentiments(state_sentiments={}):
     for name, shapes in us_states.items():
         sentiment = state_sentiments.get(name, None)
         draw_state(shapes, sentiment)
-    for name, shapes in us_states.items():
-        center = find_center(shapes)
+    for name, center in state_centers().items():
         if center is not None:
             draw_name(name, center)
 
@@ -660,14 +830,11 @@ def draw_map_for_term(term='my job'):
     
 def draw_map_by_hour(term='my job', pause=0.5):
     """Draw the sentiment map for tweets that match term, for each hour."""
-    tweets = load_tweets(make_tweet, term)
-    tweets_by_hour = group_tweets_by_hour(tweets)
+    tweets = iter_tweets(make_tweet, term)
+    sentiments_by_hour = stream_sentiments_by_hour(tweets)
 
     for hour in range(24):
-        current_tweets = tweets_by_hour.get(hour, [])
-        tweets_by_state = group_tweets_by_state(current_tweets)
-        state_sentiments = average_sentiments(tweets_by_state)
-        draw_state_sentiments(state_sentiments)
+        draw_state_sentiments(sentiments_by_hour.get(hour, {}))
         message("{0:02}:00-{0:02}:59".format(hour))
         wait(pause)
 